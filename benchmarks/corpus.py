@@ -0,0 +1,37 @@
+'''
+Synthetic student code built from the smell patterns the tests exercise.
+
+Every dedented snippet in tests/test_qchecker.py, plus example.py, is a
+self-contained module; repeating them back to back gives a valid document
+of any length with a realistic density of matches.
+'''
+
+import ast
+from pathlib import Path
+from textwrap import dedent
+
+ROOT = Path(__file__).parent.parent
+
+
+def samples():
+    tree = ast.parse((ROOT / 'tests' / 'test_qchecker.py').read_text())
+    snippets = [ dedent(node.args[0].value)
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Call)
+        and getattr(node.func, 'id', None) == 'dedent'
+        and isinstance(node.args[0], ast.Constant)
+    ]
+    snippets.append((ROOT / 'example.py').read_text().expandtabs(4))
+    return [ snippet.strip('\n') + '\n\n' for snippet in snippets ]
+
+
+def generate(lines: int):
+    '''a document of at least `lines` lines'''
+    snippets = samples()
+    parts = []
+    count = 0
+    while count < lines:
+        snippet = snippets[len(parts) % len(snippets)]
+        parts.append(snippet)
+        count += snippet.count('\n')
+    return ''.join(parts)
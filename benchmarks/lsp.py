@@ -0,0 +1,77 @@
+'''
+Just enough of an LSP client to talk to the server the way an editor does.
+
+Messages are framed with a Content-Length header. `read` takes them from a
+blocking binary stream, `Client` from an asyncio stream pair, as the
+benchmarks and the tests that go over a real connection need.
+'''
+
+import json
+
+
+def encode(message):
+    '''`message` as a framed JSON-RPC message'''
+    body = json.dumps({ 'jsonrpc': '2.0', **message }).encode()
+    return b'Content-Length: %d\r\n\r\n' % len(body) + body
+
+
+def read(stream):
+    '''the next message as (its raw bytes, its body), (None, None) at the end'''
+    header = b''
+    length = 0
+    while True:
+        line = stream.readline()
+        if not line: return None, None
+        header += line
+        if line in (b'\r\n', b'\n'): break
+        length = _length(line, length)
+    body = stream.read(length)
+    return header + body, body
+
+
+async def receive(reader):
+    '''the next message from an asyncio `reader`, None at the end'''
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line: return None
+        if line in (b'\r\n', b'\n'): break
+        length = _length(line, length)
+    return json.loads(await reader.readexactly(length))
+
+
+def _length(line: bytes, length: int):
+    name, _, value = line.decode().partition(':')
+    return int(value) if name.lower() == 'content-length' else length
+
+
+class Client:
+    '''one connection to the server over asyncio streams'''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def send(self, message):
+        self.writer.write(encode(message))
+
+    async def receive(self):
+        return await receive(self.reader)
+
+    async def until(self, predicate, config=None):
+        '''read messages, answering configuration requests with `config`, until one satisfies `predicate`'''
+        while True:
+            message = await self.receive()
+            if message is None:
+                raise EOFError('server closed the connection')
+            if config is not None and message.get('method') == 'workspace/configuration':
+                self.send({ 'id': message['id'], 'result': [ config ] * len(message['params']['items']) })
+            elif predicate(message):
+                return message
+
+    async def result(self, request_id: int, config=None):
+        '''the result of request `request_id`'''
+        message = await self.until(lambda message: message.get('id') == request_id and 'method' not in message, config)
+        if 'error' in message:
+            raise RuntimeError(f"{message['error'].get('message')} (request {request_id})")
+        return message.get('result')
@@ -0,0 +1,98 @@
+'''
+Benchmark of the memory a document's matches take.
+
+    python -m benchmarks.memory [--sizes 1000 20000 ...] [--output memory.json]
+
+The matches of a synthetic document are kept the ways the server has kept
+them, and the bytes each way holds on to are measured with tracemalloc:
+
+    pairs        (TextRange, substructure) tuples in a list
+    rows         (from_line, from_offset, to_line, to_offset, substructure)
+                 tuples in a list, as segments held them
+    diagnostics  one pydantic `Diagnostic` per match
+    store        a `MatchStore`
+
+and reported in bytes per match.
+'''
+
+import argparse
+import gc
+import json
+import platform
+import sys
+import tracemalloc
+
+from qchecker.substructures import SUBSTRUCTURES
+
+from server.engine import find_matches
+from server.incremental import IncrementalAnalysis
+from server.matches import MatchStore
+from server.server import PyDeodoriserServer
+
+from .corpus import generate
+
+SIZES = (1000, 5000, 20000)
+
+
+def retained(build):
+    '''bytes still allocated once `build()` returns, while its result is alive'''
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def bench_size(lines: int):
+    analysis = IncrementalAnalysis(lambda source, tree: find_matches(source, SUBSTRUCTURES, tree, fused=True))
+    analysis.full(generate(lines))
+    store = analysis.matches()
+    rows = store.rows()
+    count = len(store)
+
+    representations = {
+        'pairs': lambda: list(store),
+        'rows': lambda: [ (from_line, from_offset, to_line, to_offset, sub)
+            for from_line, from_offset, to_line, to_offset, sub in rows
+        ],
+        'diagnostics': lambda: store.diagnostics(PyDeodoriserServer._make_diagnostic),
+        'store': lambda: MatchStore.from_rows(rows),
+    }
+    sizes = { name: retained(build) for name, build in representations.items() }
+    return {
+        'lines': lines,
+        'matches': count,
+        'bytes_per_match': { name: size / max(count, 1) for name, size in sizes.items() },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.memory', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--output', default=None, help='write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        entry = bench_size(size)
+        results.append(entry)
+        per_match = entry['bytes_per_match']
+        before = per_match['pairs'] + per_match['rows'] + per_match['diagnostics']
+        after = 2 * per_match['store']  # the document's store and its segments' ones
+        print(
+            f"{size:>6} lines  {entry['matches']:>6} matches  "
+            + '  '.join( f'{name} {value:7.1f}' for name, value in per_match.items() )
+            + f'  B/match, kept per document {before:7.1f} -> {after:5.1f}'
+        )
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({ 'python': platform.python_version(), 'results': results }, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
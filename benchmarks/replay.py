@@ -0,0 +1,508 @@
+'''
+Load test replaying LSP sessions against a locally launched server.
+
+    python -m benchmarks.replay synthesise session.jsonl [--lines 2000] [--bursts 20]
+    python -m benchmarks.replay record session.jsonl -- python -m server
+    python -m benchmarks.replay play [session.jsonl] [--clients 8] [--speed 1]
+                                     [--transport stdio|tcp] [--output load.json]
+
+A session is JSON lines, one message from the editor each: the seconds since
+the session started, the method and its params. `synthesise` types smelly
+statements into a synthetic document a key at a time, hovering and pausing
+between bursts. `record` goes between an editor and the server, e.g. as the
+command the extension launches, passes everything through and writes down
+the didOpen, didChange, didClose and hover messages the editor sends.
+
+`play` launches the server, a process per client over stdio or a daemon
+they all connect to over TCP, and replays the session, synthesised if none
+is given, from every client at once at `--speed` times its pace (0 for no
+waiting). It reports:
+
+    throughput          messages sent and diagnostics received per second
+    diagnostic latency  from sending a version to receiving its diagnostics
+    hover latency       from request to response
+    stale publishes     diagnostics for a version older than the latest sent
+    dropped publishes   pauses in typing at the end of which the client did
+                        not show the diagnostics of the text as it was;
+                        pauses on text that does not parse, or at speed 0,
+                        are not checked
+'''
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+from functools import partial
+
+from pygls.lsp.methods import (
+    HOVER,
+    TEXT_DOCUMENT_DID_CHANGE,
+    TEXT_DOCUMENT_DID_CLOSE,
+    TEXT_DOCUMENT_DID_OPEN,
+    TEXT_DOCUMENT_PUBLISH_DIAGNOSTICS,
+)
+from pygls.lsp.types import (
+    DidChangeTextDocumentParams,
+    DidCloseTextDocumentParams,
+    DidOpenTextDocumentParams,
+    HoverParams,
+    Position,
+    Range,
+    TextDocumentContentChangeEvent,
+    TextDocumentIdentifier,
+    TextDocumentItem,
+    VersionedTextDocumentIdentifier,
+)
+from pygls.workspace import Document
+from qchecker.substructures import SUBSTRUCTURES
+
+from server.engine import find_matches, parse
+from server.incremental import IncrementalAnalysis
+
+from . import lsp
+from .corpus import ROOT, generate
+from .startup import ENVIRONMENT, working_directory
+from .validate import summary
+
+RECORDED = (TEXT_DOCUMENT_DID_OPEN, TEXT_DOCUMENT_DID_CHANGE, TEXT_DOCUMENT_DID_CLOSE, HOVER)
+# no time budgets, so what the server publishes is the complete analysis the pauses are checked against
+CONFIG = {
+    'substructures': { sub.name: True for sub in SUBSTRUCTURES },
+    'ruleBudgetMs': 0,
+    'documentBudgetMs': 0,
+}
+# typed by synthesised sessions, each a statement on a line of its own
+STATEMENTS = (
+    'total = total + 1',
+    'count = count * 2',
+    'flag = not not flag',
+    'value = value - 0',
+)
+# column 0 text a statement cannot be inserted in front of
+CONTINUATIONS = ('else', 'elif', 'except', 'finally', ')', ']', '}', '#')
+
+
+def dump(model):
+    return json.loads(model.json(by_alias=True, exclude_unset=True))
+
+
+def write_session(path: str, events):
+    with open(path, 'w') as file:
+        for event in events:
+            file.write(json.dumps(event) + '\n')
+
+
+def read_session(path: str):
+    with open(path) as file:
+        return [ json.loads(line) for line in file if line.strip() ]
+
+
+def synthesise(lines: int = 2000, bursts: int = 20, keystroke: float = 0.05, pause: float = 1.0,
+               hovers: int = 2, seed: int = 0):
+    '''a session typing `bursts` statements into a document of `lines` lines'''
+    rng = random.Random(seed)
+    uri = (ROOT / 'benchmark_replay.py').as_uri()
+    document = Document(uri, generate(lines), 1)
+    events = [ _event(0.0, TEXT_DOCUMENT_DID_OPEN, DidOpenTextDocumentParams(text_document=TextDocumentItem(
+        uri=uri, language_id='python', version=1, text=document.source,
+    ))) ]
+
+    now = pause
+    for _ in range(bursts):
+        line, indent = _insertion_point(document.source, rng)
+        for character, key in enumerate(indent + rng.choice(STATEMENTS) + '\n'):
+            position = Position(line=line, character=character)
+            change = TextDocumentContentChangeEvent(range=Range(start=position, end=position), text=key)
+            document.apply_change(change)
+            document.version += 1
+            events.append(_event(now, TEXT_DOCUMENT_DID_CHANGE, DidChangeTextDocumentParams(
+                text_document=VersionedTextDocumentIdentifier(uri=uri, version=document.version),
+                content_changes=[ change ],
+            )))
+            now += keystroke
+        for _ in range(hovers):
+            now += keystroke
+            events.append(_event(now, HOVER, HoverParams(
+                text_document=TextDocumentIdentifier(uri=uri),
+                position=Position(line=rng.randrange(len(document.lines)), character=rng.randrange(20)),
+            )))
+        now += pause
+    events.append(_event(now, TEXT_DOCUMENT_DID_CLOSE, DidCloseTextDocumentParams(
+        text_document=TextDocumentIdentifier(uri=uri),
+    )))
+    return events
+
+
+def _event(seconds: float, method: str, params):
+    return { 'time': round(seconds, 4), 'method': method, 'params': dump(params) }
+
+
+def _insertion_point(source: str, rng):
+    '''(line, indentation) a statement can be typed in front of, keeping the document valid'''
+    lines = source.splitlines(keepends=True)
+    while True:
+        line = rng.randrange(1, len(lines))
+        text = lines[line]
+        stripped = text.lstrip()
+        if not stripped.strip() or stripped.startswith(CONTINUATIONS) or lines[line-1].lstrip().startswith('@'):
+            continue
+        indent = text[:len(text) - len(stripped)]
+        if parse(''.join(lines[:line] + [ indent + 'pass\n' ] + lines[line:])) is not None:
+            return line, indent
+
+
+def record(path: str, command):
+    '''pass stdin and stdout between an editor and `command`, writing down what the editor sends'''
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    start = time.perf_counter()
+    with open(path, 'w') as file:
+        while True:
+            raw, body = lsp.read(sys.stdin.buffer)
+            if raw is None: break
+            process.stdin.write(raw)
+            process.stdin.flush()
+            message = json.loads(body)
+            if message.get('method') in RECORDED:
+                file.write(json.dumps({
+                    'time': round(time.perf_counter() - start, 4),
+                    'method': message['method'],
+                    'params': message.get('params'),
+                }) + '\n')
+                file.flush()
+    process.stdin.close()
+    return process.wait()
+
+
+class Client(lsp.Client):
+    '''one replaying editor: its connection and everything timed on it'''
+
+    def __init__(self, reader, writer, config):
+        super().__init__(reader, writer)
+        self.config = config
+        self.next_id = 0
+        self.requests = {}  # { id: future }
+        self.sent = {}  # { (uri, version): time sent }
+        self.latest = {}  # { uri: latest version sent }
+        self.touched = {}  # { uri: [ time of every didChange and didClose ] }
+        self.pauses = []  # (time, uri, text) after the last edit before a pause
+        self.publishes = []  # (time, uri, diagnostics)
+        self.latencies = []
+        self.hovers = []
+        self.messages = 0
+        self.stale = 0
+
+    def notify(self, method: str, params):
+        self.messages += 1
+        self.send({ 'method': method, 'params': params })
+
+    def request(self, method: str, params):
+        self.messages += 1
+        self.next_id += 1
+        future = self.requests[self.next_id] = asyncio.get_running_loop().create_future()
+        self.send({ 'id': self.next_id, 'method': method, 'params': params })
+        return future
+
+    async def listen(self):
+        while True:
+            message = await self.receive()
+            if message is None: return
+            received = time.perf_counter()
+            method = message.get('method')
+            if method is None:
+                future = self.requests.pop(message.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(message.get('result'))
+            elif method == 'workspace/configuration':
+                self.send({ 'id': message['id'], 'result': [ self.config ] * len(message['params']['items']) })
+            elif 'id' in message:
+                self.send({ 'id': message['id'], 'result': None })
+            elif method == TEXT_DOCUMENT_PUBLISH_DIAGNOSTICS:
+                self._published(received, message['params'])
+
+    def _published(self, received: float, params):
+        uri, version = params['uri'], params.get('version')
+        self.publishes.append((received, uri, params['diagnostics']))
+        if version is None: return
+        if version < self.latest.get(uri, version):
+            self.stale += 1
+        sent = self.sent.get((uri, version))
+        if sent is not None:
+            self.latencies.append(received - sent)
+
+    async def initialize(self):
+        await self.request('initialize', { 'processId': None, 'rootUri': None, 'capabilities': {} })
+        self.notify('initialized', {})
+
+    async def play(self, events, speed: float, pauses):
+        '''send `events` at `speed` times their pace; `pauses` are the indexes of edits followed by one'''
+        documents = {}
+        start = time.perf_counter()
+        for index, event in enumerate(events):
+            if speed:
+                await asyncio.sleep(max(0.0, start + event['time'] / speed - time.perf_counter()))
+            else:
+                await asyncio.sleep(0)
+            method, params = event['method'], event['params']
+            now = time.perf_counter()
+            if method == HOVER:
+                self.request(method, params).add_done_callback(partial(self._hovered, now))
+                continue
+            self.notify(method, params)
+
+            if method == TEXT_DOCUMENT_DID_OPEN:
+                item = DidOpenTextDocumentParams(**params).text_document
+                documents[item.uri] = Document(item.uri, item.text, item.version)
+                self._sent(now, item.uri, item.version)
+            elif method == TEXT_DOCUMENT_DID_CHANGE:
+                change = DidChangeTextDocumentParams(**params)
+                document = documents[change.text_document.uri]
+                for content_change in change.content_changes:
+                    document.apply_change(content_change)
+                self._sent(now, document.uri, change.text_document.version)
+                self.touched.setdefault(document.uri, []).append(now)
+                if index in pauses:
+                    self.pauses.append((now, document.uri, document.source))
+            elif method == TEXT_DOCUMENT_DID_CLOSE:
+                self.touched.setdefault(params['textDocument']['uri'], []).append(now)
+
+    def _sent(self, now: float, uri: str, version: int):
+        self.sent[uri, version] = now
+        self.latest[uri] = version
+
+    def _hovered(self, sent: float, future):
+        if not future.cancelled():
+            self.hovers.append(time.perf_counter() - sent)
+
+    async def close(self):
+        '''the server's statistics, then shut it down'''
+        stats = await asyncio.wait_for(self.request('deodorant/stats', None), 10)
+        await asyncio.wait_for(self.request('shutdown', None), 10)
+        self.notify('exit', None)
+        self.writer.close()
+        return stats
+
+    def shown(self, uri: str, at: float):
+        '''the diagnostics the editor showed for `uri` at time `at`'''
+        shown = None
+        for received, published_uri, diagnostics in self.publishes:
+            if received > at: break
+            if published_uri == uri:
+                shown = diagnostics
+        return { (d['range']['start']['line'], d['range']['start']['character'],
+                  d['range']['end']['line'], d['range']['end']['character'], d['message'])
+            for d in shown or ()
+        }
+
+
+def pauses_in(events, idle: float):
+    '''indexes of the edits followed by at least `idle` seconds without one, or by none at all'''
+    edits = [ (index, event['time'], event['params']['textDocument']['uri'])
+        for index, event in enumerate(events) if event['method'] == TEXT_DOCUMENT_DID_CHANGE
+    ]
+    found = set()
+    following = {}  # { uri: time of the next edit }, going backwards
+    for index, seconds, uri in reversed(edits):
+        later = following.get(uri)
+        if later is None or later - seconds >= idle:
+            found.add(index)
+        following[uri] = seconds
+    return found
+
+
+def expected(source: str, rules, cache: dict):
+    '''the diagnostics of `source` as (start line, character, end line, character, message), None if it does not parse'''
+    if source not in cache:
+        analysis = IncrementalAnalysis(lambda text, tree: find_matches(text, rules, tree, fused=True), rules)
+        cache[source] = None
+        if parse(source) is not None:
+            analysis.full(source)
+            cache[source] = { (from_line-1, from_offset, to_line-1, to_offset, sub.name)
+                for from_line, from_offset, to_line, to_offset, sub in analysis.matches().rows()
+            }
+    return cache[source]
+
+
+def check_pauses(clients, end: float, config):
+    '''(checked, dropped, unchecked) pauses over every client'''
+    rules = [ sub for sub in SUBSTRUCTURES if config['substructures'].get(sub.name) ]
+    cache = {}
+    checked = dropped = unchecked = 0
+    for client in clients:
+        for paused, uri, source in client.pauses:
+            want = expected(source, rules, cache)
+            if want is None:
+                unchecked += 1
+                continue
+            # the pause lasts until the document is edited again or closed
+            resumed = next(( sent for sent in client.touched[uri] if sent > paused ), end)
+            checked += 1
+            if client.shown(uri, resumed) != want:
+                dropped += 1
+    return checked, dropped, unchecked
+
+
+async def connect(transport: str, clients: int, workers: int, cwd: str):
+    '''launch the server in `cwd` and connect `clients` to it, returning (processes, connections)'''
+    if transport == 'stdio':
+        processes = [ await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'server', cwd=cwd, env=ENVIRONMENT,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        ) for _ in range(clients) ]
+        return processes, [ (process.stdout, process.stdin) for process in processes ]
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-m', 'server', '--tcp', '--daemon', '--port', str(port), '--workers', str(workers),
+        cwd=cwd, env=ENVIRONMENT, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            connection = await asyncio.open_connection('127.0.0.1', port)
+            break
+        except OSError:
+            if time.monotonic() > deadline: raise
+            await asyncio.sleep(0.05)
+    connections = [ connection ] + [ await asyncio.open_connection('127.0.0.1', port) for _ in range(clients - 1) ]
+    return [ process ], connections
+
+
+async def play(events, clients: int = 4, speed: float = 1.0, transport: str = 'stdio', workers: int = 1,
+               idle: float = 0.5, settle: float = 2.0, config=None):
+    config = config or CONFIG
+    with working_directory() as cwd:
+        return await _play(events, clients, speed, transport, workers, idle, settle, config, cwd)
+
+
+async def _play(events, clients: int, speed: float, transport: str, workers: int,
+                idle: float, settle: float, config, cwd: str):
+    processes, connections = await connect(transport, clients, workers, cwd)
+    players = [ Client(reader, writer, config) for reader, writer in connections ]
+    listeners = [ asyncio.ensure_future(player.listen()) for player in players ]
+    try:
+        await asyncio.wait_for(asyncio.gather(*( player.initialize() for player in players )), 60)
+        # sent without waiting the session has no pauses to check; `idle` is in time as played,
+        # the session's own gaps are `speed` times longer
+        pauses = pauses_in(events, idle * speed) if speed else set()
+        start = time.perf_counter()
+        await asyncio.gather(*( player.play(events, speed, pauses) for player in players ))
+        played = time.perf_counter() - start
+        await asyncio.sleep(settle)
+        end = time.perf_counter()
+        stats = await asyncio.gather(*( player.close() for player in players ))
+    finally:
+        for listener in listeners:
+            listener.cancel()
+        for process in processes:
+            if process.returncode is None:
+                try:
+                    await asyncio.wait_for(process.wait(), 5)
+                except asyncio.TimeoutError:
+                    process.kill()
+    return report(players, stats, played, end, config, transport, speed)
+
+
+def report(players, stats, played: float, end: float, config, transport: str, speed: float):
+    checked, dropped, unchecked = check_pauses(players, end, config)
+    latencies = [ latency for player in players for latency in player.latencies ]
+    hovers = [ hover for player in players for hover in player.hovers ]
+    publishes = sum( len(player.publishes) for player in players )
+    messages = sum( player.messages for player in players )
+    return {
+        'transport': transport,
+        'clients': len(players),
+        'speed': speed,
+        'played_s': played,
+        'messages': messages,
+        'messages_per_s': messages / played if played else 0.0,
+        'publishes': publishes,
+        'publishes_per_s': publishes / played if played else 0.0,
+        'diagnostic_latency_ms': _percentiles(latencies),
+        'hover_ms': _percentiles(hovers),
+        'stale_publishes': sum( player.stale for player in players ),
+        'pauses': { 'checked': checked, 'dropped': dropped, 'unchecked': unchecked },
+        'server': _totals([ { **entry['scheduler'], **entry['publish'] } for entry in stats ]),
+    }
+
+
+def _percentiles(samples):
+    if not samples: return None
+    return { **summary(samples), 'max': max(samples) * 1e3 }
+
+
+def _totals(entries):
+    totals = {}
+    for entry in entries:
+        for name, value in entry.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.replay', description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    synthesise_parser = commands.add_parser('synthesise', help='write a synthetic typing session')
+    synthesise_parser.add_argument('session')
+    record_parser = commands.add_parser('record', help='record the session of an editor talking to COMMAND')
+    record_parser.add_argument('session')
+    record_parser.add_argument('server', nargs=argparse.REMAINDER, metavar='-- COMMAND')
+    play_parser = commands.add_parser('play', help='replay a session against a local server')
+    play_parser.add_argument('session', nargs='?', default=None, help='synthesised when left out')
+
+    for command in (synthesise_parser, play_parser):
+        command.add_argument('--lines', type=int, default=2000, help='size of a synthesised document')
+        command.add_argument('--bursts', type=int, default=20, help='statements a synthesised session types')
+        command.add_argument('--keystroke-ms', type=float, default=50, help='time between two keys')
+        command.add_argument('--pause-ms', type=float, default=1000, help='time between two bursts of typing')
+        command.add_argument('--seed', type=int, default=0)
+    play_parser.add_argument('--clients', type=int, default=4)
+    play_parser.add_argument('--speed', type=float, default=1.0, help='times the session pace, 0 to send without waiting')
+    play_parser.add_argument('--transport', choices=('stdio', 'tcp'), default='stdio',
+        help='a server process per client, or one daemon for all of them')
+    play_parser.add_argument('--workers', type=int, default=1, help='worker threads of the daemon')
+    play_parser.add_argument('--idle-ms', type=float, default=500, help='a gap between edits, as played, counted as a pause')
+    play_parser.add_argument('--settle-ms', type=float, default=2000, help='time to wait for diagnostics at the end')
+    play_parser.add_argument('--config', default=None, help='JSON settings sent to the server instead of the defaults')
+    play_parser.add_argument('--output', default=None, help='write the report as JSON to this file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        server = args.server[1:] if args.server[:1] == [ '--' ] else args.server
+        if not server:
+            parser.error('record needs the server command after --')
+        return record(args.session, server)
+
+    events = read_session(args.session) if getattr(args, 'session', None) and args.command == 'play' else synthesise(
+        args.lines, args.bursts, args.keystroke_ms / 1000, args.pause_ms / 1000, seed=args.seed,
+    )
+    if args.command == 'synthesise':
+        write_session(args.session, events)
+        print(f'{len(events)} messages over {events[-1]["time"]:.1f} s written to {args.session}')
+        return 0
+
+    config = { **CONFIG, **json.loads(args.config) } if args.config else CONFIG
+    result = asyncio.run(play(events, args.clients, args.speed, args.transport, args.workers,
+        args.idle_ms / 1000, args.settle_ms / 1000, config))
+    latency, hover = result['diagnostic_latency_ms'] or {}, result['hover_ms'] or {}
+    print(f"{result['clients']} clients over {result['transport']}, {result['played_s']:.1f} s:"
+          f" {result['messages_per_s']:.0f} messages/s, {result['publishes_per_s']:.1f} publishes/s")
+    print(f"diagnostic latency p50 {latency.get('p50', 0):8.1f} ms  p99 {latency.get('p99', 0):8.1f} ms"
+          f"  max {latency.get('max', 0):8.1f} ms")
+    print(f"hover              p50 {hover.get('p50', 0):8.1f} ms  p99 {hover.get('p99', 0):8.1f} ms")
+    print(f"stale publishes {result['stale_publishes']}, dropped {result['pauses']['dropped']}"
+          f" of {result['pauses']['checked']} pauses checked ({result['pauses']['unchecked']} did not parse)")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+'''
+Benchmark of language server cold start.
+
+    python -m benchmarks.startup [--runs 10] [--no-warm-up] [--output startup.json]
+
+Each run starts `python -m server` over stdio, initializes it, opens a
+document and waits for its diagnostics. Reported per run: the time until
+the initialize response and until the first publishDiagnostics, both from
+process launch, plus the bare `import server.server` time in a fresh
+interpreter for comparison.
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import lsp
+from .corpus import ROOT, generate
+from .validate import summary
+
+CONFIG = { 'debounce': 0 }
+ENVIRONMENT = { **os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [ str(ROOT), os.environ.get('PYTHONPATH') ])) }
+
+
+def working_directory():
+    '''a temporary directory to run the server in, which writes its log to the working directory'''
+    return tempfile.TemporaryDirectory(prefix='deodorant-benchmark-')
+
+
+def import_time():
+    start = time.perf_counter()
+    subprocess.run([ sys.executable, '-c', 'import server.server' ], cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+
+class Session:
+    '''just enough of an LSP client to drive the server over stdio'''
+
+    def __init__(self, args, cwd: str):
+        self.process = subprocess.Popen(
+            [ sys.executable, '-m', 'server', *args ],
+            cwd=cwd, env=ENVIRONMENT,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        self.next_id = 0
+
+    def send(self, message):
+        self.process.stdin.write(lsp.encode(message))
+        self.process.stdin.flush()
+
+    def request(self, method: str, params):
+        self.next_id += 1
+        self.send({ 'id': self.next_id, 'method': method, 'params': params })
+        return self.next_id
+
+    def receive(self):
+        _, body = lsp.read(self.process.stdout)
+        if body is None:
+            raise EOFError('server exited')
+        return json.loads(body)
+
+    def until(self, predicate, substructures):
+        '''read messages, answering configuration requests, until one satisfies `predicate`'''
+        while True:
+            message = self.receive()
+            if message.get('method') == 'workspace/configuration':
+                self.send({ 'id': message['id'], 'result': [ { **CONFIG, 'substructures': substructures } ] })
+            elif predicate(message):
+                return message
+
+    def close(self):
+        self.request('shutdown', None)
+        self.send({ 'method': 'exit', 'params': None })
+        self.process.stdin.close()
+        self.process.wait(timeout=10)
+
+
+def run(source: str, substructures, args, cwd: str):
+    start = time.perf_counter()
+    session = Session(args, cwd)
+    try:
+        initialize = session.request('initialize', {
+            'processId': None, 'rootUri': None, 'capabilities': {},
+        })
+        session.until(lambda message: message.get('id') == initialize, substructures)
+        initialized = time.perf_counter() - start
+
+        session.send({ 'method': 'initialized', 'params': {} })
+        session.send({ 'method': 'textDocument/didOpen', 'params': { 'textDocument': {
+            'uri': (ROOT / 'benchmark_startup.py').as_uri(), 'languageId': 'python', 'version': 1, 'text': source,
+        } } })
+        session.until(lambda message: message.get('method') == 'textDocument/publishDiagnostics', substructures)
+        first_diagnostic = time.perf_counter() - start
+    finally:
+        session.close()
+    return initialized, first_diagnostic
+
+
+def main(argv=None):
+    from qchecker.substructures import SUBSTRUCTURES
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.startup', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--lines', type=int, default=200, help='size of the document opened')
+    parser.add_argument('--no-warm-up', dest='warm_up', action='store_false')
+    parser.add_argument('--output', default=None, help='write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    source = generate(args.lines)
+    substructures = { sub.name: True for sub in SUBSTRUCTURES }
+    server_args = [] if args.warm_up else [ '--no-warm-up' ]
+    imports = [ import_time() for _ in range(args.runs) ]
+    with working_directory() as cwd:
+        runs = [ run(source, substructures, server_args, cwd) for _ in range(args.runs) ]
+
+    report = {
+        'python': sys.version.split()[0],
+        'warm_up': args.warm_up,
+        'import_ms': summary(imports),
+        'initialize_ms': summary([ initialized for initialized, _ in runs ]),
+        'first_diagnostic_ms': summary([ first for _, first in runs ]),
+    }
+    for name in ('import_ms', 'initialize_ms', 'first_diagnostic_ms'):
+        print(f"{name:<20} p50 {report[name]['p50']:8.1f} ms  p99 {report[name]['p99']:8.1f} ms")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
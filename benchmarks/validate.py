@@ -0,0 +1,186 @@
+'''
+Benchmark of the validation hot path on synthetic documents.
+
+    python -m benchmarks.validate [--sizes 100 1000 ...] [--output bench.json]
+                                  [--baseline old.json [--tolerance 1.2]]
+
+For each document size it records per-substructure time, validate latency
+(p50/p99), diagnostic building, publishDiagnostics serialisation through
+pydantic and from the match store, hover lookup, the blocks a validation
+allocates for its result and its peak memory, and writes everything as JSON.
+With --baseline the run is compared against an earlier result and exits with
+status 1 on a regression.
+'''
+
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from pygls.lsp.types import PublishDiagnosticsParams
+from qchecker.substructures import SUBSTRUCTURES
+
+from server.engine import find_matches, parse
+from server.incremental import IncrementalAnalysis
+from server.intervals import IntervalIndex
+from server.payload import DiagnosticEncoder
+from server.server import PyDeodoriserServer
+
+from .corpus import generate
+
+SIZES = (100, 1000, 5000, 20000, 50000)
+HOVER_SAMPLES = 2000
+URI = 'file:///benchmark.py'
+ENCODER = DiagnosticEncoder(PyDeodoriserServer.DIAGNOSTIC_SOURCE, 2)
+
+
+def percentile(samples, fraction: float):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary(samples, scale: float = 1e3):
+    return {
+        'p50': percentile(samples, 0.5) * scale,
+        'p99': percentile(samples, 0.99) * scale,
+        'mean': statistics.fmean(samples) * scale,
+    }
+
+
+def timed(function, repeats: int):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def validate(source: str):
+    analysis = IncrementalAnalysis(lambda source, tree: find_matches(source, SUBSTRUCTURES, tree, fused=True))
+    analysis.full(source)
+    matches = analysis.matches()
+    index = IntervalIndex(matches)
+    payload = ENCODER.notification(URI, matches)
+    return matches, index, payload
+
+
+def bench_size(lines: int, repeats: int = None):
+    source = generate(lines)
+    repeats = repeats or max(3, min(30, 100_000 // lines))
+    tree = parse(source)
+
+    rules = {
+        sub.name: statistics.median(timed(lambda: find_matches(source, [ sub ], tree), repeats)) * 1e3
+        for sub in SUBSTRUCTURES
+    }
+    validate_samples = timed(lambda: validate(source), repeats)
+    matches, index, _ = validate(source)
+    diagnostic_samples = timed(lambda: matches.diagnostics(PyDeodoriserServer._make_diagnostic), repeats)
+    pydantic_samples = timed(lambda: PublishDiagnosticsParams(
+        uri=URI, diagnostics=matches.diagnostics(PyDeodoriserServer._make_diagnostic),
+    ).json(by_alias=True, exclude_unset=True), repeats)
+    payload_samples = timed(lambda: ENCODER.notification(URI, matches), repeats)
+
+    rng = random.Random(lines)
+    line_count = source.count('\n')
+    positions = [ (rng.randrange(line_count), rng.randrange(40)) for _ in range(HOVER_SAMPLES) ]
+    hover_samples = []
+    for line, character in positions:
+        start = time.perf_counter()
+        index.first(line, character)
+        hover_samples.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    # tracemalloc only sees blocks still alive: the result is kept and the garbage
+    # cycles the run left are collected, so the count is what the validation holds on to
+    result = validate(source)
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    allocated = snapshot.statistics('filename')
+
+    return {
+        'lines': line_count,
+        'matches': len(matches),
+        'repeats': repeats,
+        'parse_ms': statistics.median(timed(lambda: parse(source), repeats)) * 1e3,
+        'rules_ms': rules,
+        'validate_ms': summary(validate_samples),
+        'diagnostics_ms': summary(diagnostic_samples),
+        'pydantic_payload_ms': summary(pydantic_samples),
+        'payload_ms': summary(payload_samples),
+        'hover_us': summary(hover_samples, 1e6),
+        'allocated_blocks': sum(stat.count for stat in allocated),
+        'allocated_kib': sum(stat.size for stat in allocated) / 1024,
+        'peak_kib': peak / 1024,
+    }
+
+
+def compare(results, baseline, tolerance: float):
+    regressions = []
+    old = { str(entry['size']): entry for entry in baseline['results'] }
+    for entry in results:
+        previous = old.get(str(entry['size']))
+        if previous is None: continue
+        for metric in ('validate_ms', 'diagnostics_ms', 'payload_ms', 'hover_us'):
+            if metric not in previous: continue
+            ratio = entry[metric]['p50'] / max(previous[metric]['p50'], 1e-9)
+            print(f"{entry['size']:>6} lines  {metric:<15} {ratio:6.2f}x")
+            if ratio > tolerance:
+                regressions.append((entry['size'], metric, ratio))
+        ratio = entry['peak_kib'] / max(previous['peak_kib'], 1e-9)
+        print(f"{entry['size']:>6} lines  {'peak_kib':<15} {ratio:6.2f}x")
+        if ratio > tolerance:
+            regressions.append((entry['size'], 'peak_kib', ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.validate', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeats', type=int, default=None)
+    parser.add_argument('--output', default=None, help='write results as JSON to this file')
+    parser.add_argument('--baseline', default=None, help='earlier JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='slowdown ratio counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        entry = { 'size': size, **bench_size(size, args.repeats) }
+        results.append(entry)
+        print(
+            f"{size:>6} lines  validate p50 {entry['validate_ms']['p50']:9.2f} ms"
+            f"  p99 {entry['validate_ms']['p99']:9.2f} ms"
+            f"  payload p50 {entry['payload_ms']['p50']:7.2f} ms (pydantic {entry['pydantic_payload_ms']['p50']:7.2f} ms)"
+            f"  hover p50 {entry['hover_us']['p50']:6.2f} us"
+            f"  peak {entry['peak_kib']:9.0f} KiB"
+        )
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
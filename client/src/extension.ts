@@ -20,7 +20,16 @@
 
 import * as net from "net";
 import * as path from "path";
-import { ExtensionContext, ExtensionMode, workspace } from "vscode";
+import {
+    DiagnosticCollection,
+    ExtensionContext,
+    ExtensionMode,
+    languages,
+    TextDocument,
+    TextEditor,
+    window,
+    workspace,
+} from "vscode";
 import {
     LanguageClient,
     LanguageClientOptions,
@@ -29,6 +38,14 @@ import {
 
 let client: LanguageClient;
 
+const VISIBLE_RANGES_NOTIFICATION = "deodorant/visibleRanges";
+const DIAGNOSTIC_REQUEST = "textDocument/diagnostic";
+
+let pulledDiagnostics: DiagnosticCollection;
+const resultIds = new Map<string, string>();
+const pulling = new Set<string>();
+const pullAgain = new Set<string>();
+
 function getClientOptions(): LanguageClientOptions {
     return {
         // Register the server for plain text documents
@@ -38,6 +55,8 @@ function getClientOptions(): LanguageClientOptions {
         ],
         outputChannelName: "[pygls] pyDeodoriserServer",
         synchronize: {
+            // Send workspace/didChangeConfiguration whenever the Deodorant settings change
+            configurationSection: "Deodorant",
             // Notify the server about file changes to '.clientrc files contain in the workspace
             fileEvents: workspace.createFileSystemWatcher("**/.clientrc"),
         },
@@ -78,6 +97,75 @@ function startLangServer(
     return new LanguageClient(command, serverOptions, getClientOptions());
 }
 
+// Tell the server which lines are on screen so it analyses them first
+function sendVisibleRanges(editor: TextEditor | undefined): void {
+    if (!editor || editor.document.languageId !== "python") {
+        return;
+    }
+    client.sendNotification(VISIBLE_RANGES_NOTIFICATION, {
+        textDocument: { uri: editor.document.uri.toString() },
+        ranges: editor.visibleRanges.map((range) =>
+            client.code2ProtocolConverter.asRange(range)
+        ),
+    });
+}
+
+// Ask the server for a document's diagnostics, sending the last result id
+// so an unchanged result comes back without its payload
+async function pullDiagnostics(document: TextDocument): Promise<void> {
+    const uri = document.uri.toString();
+    if (document.languageId !== "python" || document.isClosed) {
+        return;
+    }
+    if (pulling.has(uri)) {
+        pullAgain.add(uri);
+        return;
+    }
+    pulling.add(uri);
+    try {
+        const report = await client.sendRequest<any>(DIAGNOSTIC_REQUEST, {
+            textDocument: { uri },
+            previousResultId: resultIds.get(uri),
+        });
+        if (report.resultId) {
+            resultIds.set(uri, report.resultId);
+        }
+        if (report.kind === "full") {
+            pulledDiagnostics.set(
+                document.uri,
+                client.protocol2CodeConverter.asDiagnostics(report.items)
+            );
+        }
+    } finally {
+        pulling.delete(uri);
+        if (pullAgain.delete(uri)) {
+            pullDiagnostics(document);
+        }
+    }
+}
+
+function pullVisible(): void {
+    window.visibleTextEditors.forEach((editor) => pullDiagnostics(editor.document));
+}
+
+function startPulling(context: ExtensionContext): void {
+    pulledDiagnostics = languages.createDiagnosticCollection("Deodorant");
+    context.subscriptions.push(
+        pulledDiagnostics,
+        window.onDidChangeVisibleTextEditors(pullVisible),
+        workspace.onDidChangeTextDocument((event) => {
+            if (window.visibleTextEditors.some((editor) => editor.document === event.document)) {
+                pullDiagnostics(event.document);
+            }
+        }),
+        workspace.onDidCloseTextDocument((document) => {
+            resultIds.delete(document.uri.toString());
+            pulledDiagnostics.delete(document.uri);
+        })
+    );
+    pullVisible();
+}
+
 export function activate(context: ExtensionContext): void {
     if (context.extensionMode === ExtensionMode.Development) {
         // Development - Run the server manually
@@ -97,6 +185,19 @@ export function activate(context: ExtensionContext): void {
     }
 
     context.subscriptions.push(client.start());
+
+    client.onReady().then(() => {
+        sendVisibleRanges(window.activeTextEditor);
+        context.subscriptions.push(
+            window.onDidChangeTextEditorVisibleRanges((event) =>
+                sendVisibleRanges(event.textEditor)
+            ),
+            window.onDidChangeActiveTextEditor(sendVisibleRanges)
+        );
+        if (workspace.getConfiguration("Deodorant").get<boolean>("pullDiagnostics")) {
+            startPulling(context);
+        }
+    });
 }
 
 export function deactivate(): Thenable<void> {
@@ -14,12 +14,15 @@
 # See the License for the specific language governing permissions and      #
 # limitations under the License.                                           #
 ############################################################################
+import time
+
+STARTED = time.perf_counter()
+
 import argparse
 import logging
+import sys
 
-from .server import pyDeodoriser
-
-logging.basicConfig(filename="pygls.log", level=logging.DEBUG, filemode="w")
+from . import cli
 
 
 def add_arguments(parser):
@@ -41,6 +44,24 @@ def add_arguments(parser):
         "--port", type=int, default=2087,
         help="Bind to this port"
     )
+    parser.add_argument(
+        "--no-warm-up", dest="warm_up", action="store_false",
+        help="Do not run the rules once after initialize"
+    )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="With --tcp or --ws, serve any number of clients from this process"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Worker threads shared by the clients of a daemon"
+    )
+
+    commands = parser.add_subparsers(dest="command")
+    scan_parser = commands.add_parser(
+        "scan", help="Scan every python file under the given paths"
+    )
+    cli.add_arguments(scan_parser)
 
 
 def main():
@@ -48,6 +69,28 @@ def main():
     add_arguments(parser)
     args = parser.parse_args()
 
+    if args.command == "scan":
+        cli.check_arguments(parser, args)
+        sys.exit(cli.run(args))
+    if args.daemon and not (args.tcp or args.ws):
+        parser.error("--daemon needs --tcp or --ws")
+
+    if args.daemon:
+        from .daemon import Daemon
+        daemon = Daemon(args.workers, args.warm_up)
+        logging.basicConfig(filename="pygls.log", level=logging.INFO, filemode="w")
+        if args.tcp:
+            daemon.start_tcp(args.host, args.port)
+        else:
+            daemon.start_ws(args.host, args.port)
+        return
+
+    from .server import pyDeodoriser
+    pyDeodoriser.started = STARTED
+    pyDeodoriser.startup_time('imported_ms')
+    pyDeodoriser.warm_up_enabled = args.warm_up
+    logging.basicConfig(filename="pygls.log", level=logging.DEBUG, filemode="w")
+
     if args.tcp:
         pyDeodoriser.start_tcp(args.host, args.port)
     elif args.ws:
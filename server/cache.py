@@ -0,0 +1,202 @@
+'''
+Memoised analysis results keyed by document content and rule set.
+
+A key combines a hash of the source with a fingerprint of the enabled
+substructures and the installed qChecker version, so identical content
+analysed under identical rules is never parsed twice. A run can `claim` its
+key while it analyses, so identical content coming in meanwhile, from
+another document or another client of the daemon, `wait`s for its result.
+
+`DiskCache` persists the same entries across server restarts as small
+zlib-compressed marshal files, one per key. Writes go through a temporary
+file and `os.replace`, so several server processes can share a directory.
+The server reads it on its workers and writes it from a thread of its own,
+and only the result a document settles on, not every version typed.
+'''
+
+import asyncio
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager, suppress
+from importlib import metadata
+
+
+def qchecker_version():
+    try:
+        return metadata.version('qchecker')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def fingerprint(substructures):
+    names = '\0'.join(sorted(sub.name for sub in substructures))
+    return hashlib.blake2b(f'{qchecker_version()}\0{names}'.encode(), digest_size=16).hexdigest()
+
+
+def content_key(source: str, rules_fingerprint: str):
+    digest = hashlib.blake2b(source.encode('utf-8', 'surrogatepass'), digest_size=16)
+    return f'{digest.hexdigest()}-{rules_fingerprint}'
+
+
+class ResultCache:
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}  # { key: future } of the analyses running now
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: str):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    @contextmanager
+    def claim(self, key: str):
+        '''mark `key` as being analysed until the block exits, on the event loop'''
+        if key in self.pending:
+            yield
+            return
+        future = self.pending[key] = asyncio.get_event_loop().create_future()
+        try:
+            yield
+        finally:
+            del self.pending[key]
+            future.set_result(None)
+
+    async def wait(self, key: str):
+        '''wait for the run that claimed `key` to finish, False if there is none'''
+        future = self.pending.get(key)
+        if future is None: return False
+        self.waits += 1
+        await asyncio.wait({ future })
+        return True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'waits': self.waits,
+        }
+
+
+class DiskCache:
+
+    MAGIC = b'DEO1' + bytes(sys.version_info[:2])  # marshal is python version specific
+    SUFFIX = '.bin'
+    EVICT_EVERY = 32  # writes between two size checks
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def path(self, key: str):
+        return os.path.join(self.directory, key[:2], key + DiskCache.SUFFIX)
+
+    def get(self, key: str):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            if not data.startswith(DiskCache.MAGIC): raise ValueError('foreign cache entry')
+            value = marshal.loads(zlib.decompress(data[len(DiskCache.MAGIC):]))
+            os.utime(path)
+        except (OSError, ValueError, EOFError, TypeError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value):
+        data = DiskCache.MAGIC + zlib.compress(marshal.dumps(value))
+        shard = os.path.dirname(self.path(key))
+        try:
+            os.makedirs(shard, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=shard, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, self.path(key))
+        except OSError:
+            with suppress(OSError):
+                os.remove(temporary)
+            return
+        self.writes += 1
+        if self.writes % DiskCache.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        '''delete least recently used entries until under 90% of the budget'''
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(DiskCache.SUFFIX): continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9: break
+            try:
+                os.remove(path)
+            except OSError:
+                continue  # another process got there first, or it is still open
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+        }
+
+
+def encode_snapshot(snapshot):
+    '''segment snapshot with substructures replaced by their names'''
+    return tuple( (start, end, block, tuple( match[:4] + (match[4].name,) for match in matches ))
+        for start, end, block, matches in snapshot
+    )
+
+
+def decode_snapshot(data, substructures: dict):
+    '''inverse of `encode_snapshot`, None if a rule is no longer known'''
+    try:
+        return tuple( (start, end, block, tuple( match[:4] + (substructures[match[4]],) for match in matches ))
+            for start, end, block, matches in data
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
@@ -0,0 +1,217 @@
+'''
+Headless batch linting outside the editor.
+
+    python -m server scan [--format text|jsonl|sarif] PATH... | -
+
+Paths may be files or directories, or `-` to read one path per line from
+stdin. Every record is written as soon as its file is analysed and nothing
+is kept once written, so memory does not grow with the size of the corpus.
+
+Exit status: 0 when nothing was found, 1 when there were matches,
+2 when some file could not be read or analysed.
+'''
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from urllib.parse import quote
+
+EXIT_CLEAN = 0
+EXIT_MATCHES = 1
+EXIT_ERROR = 2
+
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+INFORMATION_URI = 'https://github.com/mightbesimon/vscode-deodorant/'
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "paths", nargs="+",
+        help="Files or directories to scan, or - to read paths from stdin"
+    )
+    parser.add_argument(
+        "--format", choices=("text", "jsonl", "sarif"), default="text",
+        help="Output format (default: text)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of worker processes (default: one per core)"
+    )
+    parser.add_argument(
+        "--rule", action="append", dest="rules",
+        help="Only run this substructure (repeatable, default: all)"
+    )
+
+
+def check_arguments(parser, args):
+    '''reject `--rule` names no substructure has, rather than scan with no rules at all'''
+    if not args.rules: return
+    from qchecker.substructures import SUBSTRUCTURES
+    names = [ sub.name for sub in SUBSTRUCTURES ]
+    unknown = [ rule for rule in args.rules if rule not in names ]
+    if unknown:
+        parser.error(f"unknown --rule {', '.join(map(repr, unknown))} (choose from {', '.join(map(repr, names))})")
+
+
+def iter_paths(paths, stdin=None):
+    for path in paths:
+        if path != '-':
+            yield path
+            continue
+        for line in stdin or sys.stdin:
+            line = line.strip()
+            if line:
+                yield line
+
+
+class TextWriter:
+
+    def __init__(self, out, substructures):
+        self.out = out
+
+    def begin(self): pass
+
+    def match(self, path, match):
+        from_line, from_offset, _, _, name = match
+        self.out.write(f'{path}:{from_line}:{from_offset + 1}: {name}\n')
+
+    def error(self, path, message): pass
+
+    def end(self, successful): pass
+
+
+class JsonLinesWriter(TextWriter):
+
+    def __init__(self, out, substructures):
+        super().__init__(out, substructures)
+        self.substructures = substructures
+
+    def match(self, path, match):
+        from_line, from_offset, to_line, to_offset, name = match
+        self._write({
+            'path': path,
+            'rule': name,
+            'code': self.substructures[name].technical_description,
+            'line': from_line,
+            'column': from_offset + 1,
+            'endLine': to_line,
+            'endColumn': to_offset + 1,
+        })
+
+    def error(self, path, message):
+        self._write({ 'path': path, 'error': message })
+
+    def _write(self, record):
+        self.out.write(json.dumps(record, separators=(',', ':')))
+        self.out.write('\n')
+
+
+class SarifWriter(JsonLinesWriter):
+    '''SARIF 2.1.0, written incrementally: header, one result at a time, footer'''
+
+    def __init__(self, out, substructures):
+        super().__init__(out, substructures)
+        self.rule_index = { name: index for index, name in enumerate(substructures) }
+        self.first = True
+
+    def begin(self):
+        rules = [
+            {
+                'id': name,
+                'name': name,
+                'shortDescription': { 'text': sub.technical_description },
+                'fullDescription': { 'markdown': sub.description.content, 'text': sub.description.content },
+            }
+            for name, sub in self.substructures.items()
+        ]
+        header = json.dumps({
+            '$schema': SARIF_SCHEMA,
+            'version': '2.1.0',
+            'runs': [ {
+                'tool': { 'driver': {
+                    'name': 'Deodorant',
+                    'informationUri': INFORMATION_URI,
+                    'rules': rules,
+                } },
+                'results': [],
+            } ],
+        })
+        # everything up to the opening bracket of the results array
+        self.out.write(header[:header.rindex('[]')+1])
+
+    def match(self, path, match):
+        from_line, from_offset, to_line, to_offset, name = match
+        self.out.write('\n' if self.first else ',\n')
+        self.first = False
+        self.out.write(json.dumps({
+            'ruleId': name,
+            'ruleIndex': self.rule_index[name],
+            'level': 'warning',
+            'message': { 'text': name },
+            'locations': [ { 'physicalLocation': {
+                'artifactLocation': { 'uri': artifact_uri(path) },
+                'region': {
+                    'startLine': from_line,
+                    'startColumn': from_offset + 1,
+                    'endLine': to_line,
+                    'endColumn': to_offset + 1,
+                },
+            } } ],
+        }))
+
+    def error(self, path, message): pass
+
+    def end(self, successful):
+        invocation = json.dumps([ { 'executionSuccessful': successful } ])
+        self.out.write(f'\n], "invocations": {invocation}}}]}}\n')
+
+
+def artifact_uri(path: str):
+    '''`path` as a URI: a file URI when absolute, a relative reference otherwise'''
+    path = Path(path)
+    return path.as_uri() if path.is_absolute() else quote(path.as_posix())
+
+
+WRITERS = {
+    'text': TextWriter,
+    'jsonl': JsonLinesWriter,
+    'sarif': SarifWriter,
+}
+
+
+def run(args, out=None, err=None):
+    from qchecker.substructures import SUBSTRUCTURES
+
+    from .scan import scan
+
+    out, err = out or sys.stdout, err or sys.stderr
+    substructures = { sub.name: sub for sub in SUBSTRUCTURES
+        if not args.rules or sub.name in args.rules
+    }
+    writer = WRITERS[args.format](out, substructures)
+    status = EXIT_CLEAN
+    writer.begin()
+    for result in scan(iter_paths(args.paths), list(substructures), args.workers):
+        if result.error:
+            err.write(f'{result.path}: error: {result.error}\n')
+            writer.error(result.path, result.error)
+            status = EXIT_ERROR
+        for match in result.matches:
+            writer.match(result.path, match)
+            status = status or EXIT_MATCHES
+    writer.end(status != EXIT_ERROR)
+    out.flush()
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m server.cli', description='Deodorant batch linter')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    check_arguments(parser, args)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
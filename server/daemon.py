@@ -0,0 +1,125 @@
+'''
+One long-lived language server process for many clients at once.
+
+    python -m server --tcp --daemon [--host 127.0.0.1] [--port 2087] [--workers 4]
+
+Every connection, over TCP or WebSocket, gets a `PyDeodoriserServer` of its
+own, so clients keep their documents, configuration and diagnostics apart.
+They share the worker pool and the results cache. That cache is keyed by
+content, and a run waits for one analysing identical content, so a file
+many clients open at once, like the starter code of a lab, is analysed
+once.
+
+A client's `exit` notification or dropped connection only ends its own
+server, never the process.
+'''
+
+import asyncio
+import importlib.util
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pygls.lsp.methods import EXIT
+from pygls.protocol import LanguageServerProtocol, deserialize_message, lsp_method
+from pygls.server import WebSocketTransportAdapter
+
+from .cache import ResultCache
+from .server import PyDeodoriserServer, create_server
+
+
+class ConnectionProtocol(LanguageServerProtocol):
+    '''one client's connection to the daemon'''
+
+    def connection_lost(self, exc):
+        self._server.daemon.disconnect(self._server)
+
+    @lsp_method(EXIT)
+    def lsp_exit(self, *args):
+        self.transport.close()
+        self._server.daemon.disconnect(self._server)
+
+
+class Daemon:
+
+    CACHE_ENTRIES = 1024  # shared by every client, so more than a single server keeps
+
+    def __init__(self, workers: int = None, warm_up: bool = True, loop=None):
+        self.loop = loop or asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.workers = max(1, workers or PyDeodoriserServer.DEFAULT_WORKERS)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='deodorant')
+        self.results = ResultCache(Daemon.CACHE_ENTRIES)
+        self.warm_up = warm_up
+        self.servers = set()
+        self.connections = 0
+        self.started = time.monotonic()
+
+    def connect(self):
+        '''a server of its own for a new client'''
+        ls = create_server(self.loop, ConnectionProtocol)
+        # pygls' Server makes a new event loop the current one, the daemon's has to stay it
+        stray = asyncio.get_event_loop_policy().get_event_loop()
+        if stray is not self.loop:
+            stray.close()
+            asyncio.set_event_loop(self.loop)
+        ls.daemon = self
+        ls.pool = self.pool
+        ls.workers = self.workers
+        ls.results = self.results
+        ls.warm_up_enabled = self.warm_up and not self.connections  # the first one warms up the process
+        self.connections += 1
+        self.servers.add(ls)
+        return ls
+
+    def disconnect(self, ls: PyDeodoriserServer):
+        if ls not in self.servers: return
+        self.servers.discard(ls)
+        ls.disconnect()
+
+    def stats(self):
+        return {
+            'clients': len(self.servers),
+            'connections': self.connections,
+            'workers': self.workers,
+            'uptime_s': time.monotonic() - self.started,
+        }
+
+    async def serve_tcp(self, host: str, port: int):
+        return await self.loop.create_server(lambda: self.connect().lsp, host, port)
+
+    async def serve_ws(self, host: str, port: int):
+        import websockets
+
+        async def connection(websocket, *args):
+            ls = self.connect()
+            ls.lsp._send_only_body = True  # a WebSocket message is the body, no headers
+            ls.lsp.transport = WebSocketTransportAdapter(websocket, self.loop)
+            try:
+                async for message in websocket:
+                    ls.lsp._procedure_handler(json.loads(message, object_hook=deserialize_message))
+            finally:
+                self.disconnect(ls)
+
+        return await websockets.serve(connection, host, port)
+
+    def start_tcp(self, host: str, port: int):
+        self._run(self.serve_tcp(host, port))
+
+    def start_ws(self, host: str, port: int):
+        if importlib.util.find_spec('websockets') is None:
+            sys.exit('Run `pip install pygls[ws]` to install `websockets`.')
+        self._run(self.serve_ws(host, port))
+
+    def _run(self, serve):
+        server = self.loop.run_until_complete(serve)
+        try:
+            self.loop.run_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+            self.pool.shutdown(wait=False)
+            self.loop.close()
@@ -0,0 +1,81 @@
+'''
+Diagnostics last published per document, to skip publishing unchanged ones.
+
+What is kept is the `MatchStore` published, compared whole against the next
+one; a publish of the same matches as last time for that uri is dropped.
+`Diagnostic`s are made from it with `make(text_range, rule)` only when sent.
+
+Each distinct set of diagnostics gets a result id, which is what pull
+requests compare to answer "unchanged" without the payload.
+'''
+
+
+class Published:
+    __slots__ = ('matches', 'result_id', 'size')
+
+    def __init__(self, matches, result_id: str):
+        self.matches = matches
+        self.result_id = result_id
+        self.size = None  # payload bytes, worked out the first time it is saved
+
+    def payload_size(self, uri: str, encoder):
+        if self.size is None:
+            self.size = len(encoder.params(uri, self.matches))
+        return self.size
+
+
+class PublishedDiagnostics:
+
+    def __init__(self, make, encoder):
+        '''`encoder` is a `DiagnosticEncoder`, for the size of what was not sent'''
+        self.make = make
+        self.encoder = encoder
+        self.published = {}
+        self.results = 0  # result ids handed out
+        self.sent = 0  # notifications the server actually wrote, counted by it
+        self.skipped = 0
+        self.unchanged = 0
+        self.bytes_saved = 0
+
+    def same(self, uri: str, matches):
+        '''whether `matches` are the ones last published for `uri`'''
+        previous = self.published.get(uri)
+        return previous is not None and previous.matches == matches
+
+    def changed(self, uri: str, matches):
+        '''whether `matches` differ from those last published for `uri`, recording them if so'''
+        previous = self.published.get(uri)
+        if previous is not None and previous.matches == matches:
+            self.skipped += 1
+            self.bytes_saved += previous.payload_size(uri, self.encoder)
+            return False
+        self.results += 1
+        self.published[uri] = Published(matches, str(self.results))
+        return True
+
+    def pull(self, uri: str, previous_result_id: str = None):
+        '''the report for a textDocument/diagnostic request'''
+        published = self.published.get(uri)
+        if published is None:
+            return { 'kind': 'full', 'items': [] }
+        if published.result_id == previous_result_id:
+            self.unchanged += 1
+            self.bytes_saved += published.payload_size(uri, self.encoder)
+            return { 'kind': 'unchanged', 'resultId': published.result_id }
+        return {
+            'kind': 'full',
+            'resultId': published.result_id,
+            'items': published.matches.diagnostics(self.make),
+        }
+
+    def forget(self, uri: str):
+        return self.published.pop(uri, None)
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'unchanged': self.unchanged,
+            'bytes_saved': self.bytes_saved,
+        }
+
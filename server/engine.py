@@ -0,0 +1,253 @@
+'''
+Single-parse detection engine.
+
+qChecker substructures take source text and parse it themselves, so running
+every enabled rule over a document used to mean one `ast.parse` per rule.
+The engine parses the document once and, while the rules run, serves that
+same tree to any `ast.parse` call made on the identical source.
+
+In fused mode the tree is also walked once and its nodes indexed by type.
+A rule listed in `TRIGGERS` is skipped outright when none of its node types
+occur, and its `ast.walk` over the whole document only visits those nodes.
+Rules without an entry fall back to their own full walk.
+
+Rules named in `first` can be run ahead of the others, with `progress`
+called on their matches before the rest start; the result is in the usual
+order either way.
+
+Sources that failed to parse are remembered, so text that is still broken
+is not parsed again on the next validation or recovery attempt. Sources too
+deeply nested for the parser (`RecursionError`, `MemoryError`) count as
+failing to parse.
+
+An optional `Budget` bounds the time of each rule and of the whole run.
+Rules cannot be interrupted mid-step, so a rule is abandoned at its next
+match once over budget, and rules left when the document budget runs out
+are not started. Budgets count the CPU time of the thread running the
+rules, so time spent waiting for the GIL behind other work is not held
+against them.
+'''
+
+import ast
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from heapq import merge
+
+_ast_parse = ast.parse
+_ast_walk = ast.walk
+_local = threading.local()
+_unparseable = {}  # (length, hash) of sources that did not parse, oldest first
+_unparseable_lock = threading.Lock()
+UNPARSEABLE_ENTRIES = 64
+
+# node types each rule starts matching from, by substructure name
+TRIGGERS = {
+    'Unnecessary Elif': (ast.If,),
+    'If/Else Return Bool': (ast.If,),
+    'Empty If Body': (ast.If,),
+    'Empty Else Body': (ast.If,),
+    'Nested If': (ast.If,),
+    'Unnecessary Else': (ast.If,),
+    'Duplicate If/Else Statement': (ast.If,),
+    'Several Duplicate If/Else Statements': (ast.If,),
+    'Duplicate If/Else Body': (ast.If,),
+    'Confusing Else': (ast.If,),
+    'Else If': (ast.If,),
+    'Augmentable Assignment': (ast.Assign,),
+    'Missed Absolute Value': (ast.BoolOp,),
+    'Mergeable Equal': (ast.BoolOp,),
+    'Repeated Addition': (ast.BinOp,),
+    'Repeated Multiplication': (ast.BinOp,),
+    'Redundant Arithmetic': (ast.BinOp, ast.UnaryOp),
+    'Redundant Not': (ast.UnaryOp,),
+    'Redundant Comparison': (ast.Compare,),
+    'Redundant For': (ast.For,),
+}
+
+# rules that only look at a single expression or statement, kept for large files
+CHEAP_RULES = (
+    'Augmentable Assignment',
+    'Missed Absolute Value',
+    'Mergeable Equal',
+    'Repeated Addition',
+    'Repeated Multiplication',
+    'Redundant Arithmetic',
+    'Redundant Not',
+    'Redundant Comparison',
+    'Redundant For',
+)
+
+
+class Budget:
+    '''CPU time limits for one validation, in seconds (None for no limit)'''
+
+    clock = staticmethod(time.thread_time)
+
+    def __init__(self, rule: float = None, document: float = None):
+        self.rule = rule
+        self.document = document
+        self.spent = 0.0  # by the rules run so far
+        self.overrun = []  # rules that went past `rule`
+        self.skipped = []  # rules not run because the document went past `document`
+
+    def document_exhausted(self):
+        return self.document is not None and self.spent > self.document
+
+    def rule_exhausted(self, started: float):
+        '''`started` is the `clock()` when the rule started'''
+        return self.rule is not None and self.clock() - started > self.rule
+
+    def charge(self, started: float):
+        self.spent += self.clock() - started
+
+    @property
+    def complete(self):
+        return not self.overrun and not self.skipped
+
+
+class NodeIndex:
+    '''nodes of one tree bucketed by type, in `ast.walk` order'''
+
+    def __init__(self, tree: ast.AST):
+        self.tree = tree
+        self.by_type = {}
+        for position, node in enumerate(_ast_walk(tree)):
+            self.by_type.setdefault(type(node), []).append((position, node))
+
+    def __contains__(self, node_type):
+        return node_type in self.by_type
+
+    def nodes(self, node_types):
+        buckets = [ self.by_type[t] for t in node_types if t in self.by_type ]
+        if len(buckets) == 1:
+            return [ node for _, node in buckets[0] ]
+        return [ node for _, node in merge(*buckets, key=lambda item: item[0]) ]
+
+
+class _Shared:
+    __slots__ = ('source', 'tree', 'index', 'triggers')
+
+    def __init__(self, source, tree, index=None):
+        self.source = source
+        self.tree = tree
+        self.index = index
+        self.triggers = None
+
+
+def _shared_parse(source, *args, **kwargs):
+    shared = getattr(_local, 'shared', None)
+    if shared and not args and not kwargs:
+        if source is shared.source or source == shared.source:
+            return shared.tree
+    return _ast_parse(source, *args, **kwargs)
+
+
+def _shared_walk(node):
+    shared = getattr(_local, 'shared', None)
+    if shared and shared.triggers and node is shared.tree:
+        return iter(shared.index.nodes(shared.triggers))
+    return _ast_walk(node)
+
+
+def _install():
+    # rules may hold `ast.parse` directly (`from ast import parse`)
+    ast.parse, ast.walk = _shared_parse, _shared_walk
+    for name, module in list(sys.modules.items()):
+        if not name.startswith('qchecker') or module is None: continue
+        for attr, value in list(vars(module).items()):
+            if value is _ast_parse:
+                setattr(module, attr, _shared_parse)
+            elif value is _ast_walk:
+                setattr(module, attr, _shared_walk)
+
+
+@contextmanager
+def shared_tree(source: str, tree: ast.Module, index: NodeIndex = None):
+    '''serve `tree` to every `ast.parse(source)` made in this thread'''
+    _install()
+    previous = getattr(_local, 'shared', None)
+    _local.shared = _Shared(source, tree, index)
+    try:
+        yield _local.shared
+    finally:
+        _local.shared = previous
+
+
+def parse(source: str):
+    key = (len(source), hash(source))
+    if key in _unparseable: return None
+    try:
+        return _ast_parse(source)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        with _unparseable_lock:
+            _unparseable[key] = True
+            if len(_unparseable) > UNPARSEABLE_ENTRIES:
+                del _unparseable[next(iter(_unparseable))]
+        return None
+
+
+def find_matches(source: str, substructures, tree: ast.Module = None, fused: bool = False,
+                 stats=None, budget: Budget = None, first=(), progress=None):
+    '''[ (match, substructure) ] for every enabled substructure, parsing once'''
+    if tree is None:
+        tree = parse(source)
+    if tree is None: return []
+
+    index = NodeIndex(tree) if fused else None
+    with shared_tree(source, tree, index) as shared:
+        if progress is None:
+            return [ (match, sub)
+                for sub in substructures
+                for match in _run(shared, sub, stats, budget)
+            ]
+        found = { sub: _run(shared, sub, stats, budget)
+            for sub in substructures if sub.name in first
+        }
+        progress([ (match, sub) for sub, matches in found.items() for match in matches ])
+        return [ (match, sub)
+            for sub in substructures
+            for match in (found[sub] if sub in found else _run(shared, sub, stats, budget))
+        ]
+
+
+def _run(shared: _Shared, substructure, stats=None, budget: Budget = None):
+    triggers = TRIGGERS.get(substructure.name) if shared.index else None
+    if triggers and not any(t in shared.index for t in triggers):
+        if stats is not None:
+            stats.skip(substructure.name)
+        return []
+    if budget is not None and budget.document_exhausted():
+        budget.skipped.append(substructure.name)
+        return []
+
+    shared.triggers = triggers
+    start = time.perf_counter()
+    cpu_start = budget.clock() if budget is not None else None
+    failed = False
+    matches = []
+    try:
+        iterator = iter(substructure.iter_matches(shared.source))
+        for match in iterator:
+            matches.append(match)
+            if budget is not None and budget.rule_exhausted(cpu_start):
+                # give up on this rule now rather than after its last match
+                getattr(iterator, 'close', lambda: None)()
+                matches = []
+                break
+    except:
+        matches, failed = [], True
+    finally:
+        shared.triggers = None
+
+    if budget is not None:
+        if budget.rule_exhausted(cpu_start):
+            # dropped even when it got to the end: the rule is skipped from the next run
+            # on, and matches shown once and then taken away would only flicker
+            budget.overrun.append(substructure.name)
+            matches = []
+        budget.charge(cpu_start)
+    if stats is not None:
+        stats.record(substructure.name, time.perf_counter() - start, len(matches), failed)
+    return matches
@@ -0,0 +1,323 @@
+'''
+Incremental re-analysis of a document split into top-level segments.
+
+Every top-level `def`/`class` (decorators included) is its own segment, and
+each run of other top-level statements between them forms one more, so rules
+that look at neighbouring statements still see them together. Segments tile
+the document: each one runs up to the line before the next begins.
+
+Matches are kept in a `MatchStore` per segment, relative to it. An edit
+marks the segments it touches dirty and shifts the ones after it, which
+only moves their start line; only dirty segments are parsed and analysed
+again.
+
+A document or region that does not parse is recovered block by block: each
+top-level block, found by indentation alone, that parses on its own is
+analysed, and the broken ones keep the matches last found on their lines
+until a later run manages to parse them.
+
+A `focus` of lines restricts a run to the dirty segments it overlaps and
+leaves the others dirty for a later `refresh`, which can stop between
+chunks of segments when asked to.
+
+With a `budget`, rules it skipped on a segment are remembered there, and
+a later `refresh` runs just those rules on it rather than analysing the
+segment, or the document, again.
+'''
+
+import ast
+import re
+from bisect import bisect_right
+
+from .engine import parse
+from .matches import MatchStore
+
+BLOCKS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# column 0 lines that carry on the block above rather than start a new one
+CONTINUATION = re.compile(r'(else|elif|except|finally)\b|[)\]}]|#|\s|$')
+BLOCK_START = re.compile(r'(async\s+def|def|class)\b')
+
+
+class Segment:
+    __slots__ = ('start', 'end', 'block', 'matches', 'stale', 'broken', 'missing')
+
+    def __init__(self, start: int, end: int, block: bool, matches=None):
+        self.start = start
+        self.end = end
+        self.block = block
+        self.matches = matches  # MatchStore, lines relative to `start`, or None if dirty
+        self.stale = None  # matches from before the segment went dirty, shown until it is analysed
+        self.broken = False  # did not parse, `matches` are the last ones found here
+        self.missing = ()  # names of the rules not run here yet, `matches` lacking theirs
+
+    def previous(self):
+        return self.matches if self.matches is not None else self.stale
+
+    def shift(self, delta: int):
+        self.start += delta
+        self.end += delta
+
+
+class IncrementalAnalysis:
+
+    def __init__(self, analyse, rules=None):
+        '''`analyse(source, tree)` returns [ (match, substructure) ] of `rules`;
+        `analyse(source, tree, subset)` of just the substructures in `subset`'''
+        self.analyse = analyse
+        self.rules = rules
+        self.budget = None  # the `Budget` `analyse` runs under, whose skipped rules are made up later
+        self.segments = []
+        self.analysed_lines = 0
+
+    def full(self, source: str, focus=None):
+        tree = parse(source)
+        if tree is None:
+            self.analysed_lines = 0
+            lines = source.splitlines(keepends=True)
+            self.segments = self._recover(lines, 1, line_count(source), self.segments)
+            return
+        if focus is None:
+            self.analysed_lines = line_count(source)
+            self.segments = self._analyse(source, tree, 1, line_count(source))
+            return
+        self.analysed_lines = 0
+        self.segments = _split(tree, 1, line_count(source))
+        for seg in self.segments:
+            seg.matches = None
+        self.refresh(source, focus)
+
+    def update(self, source: str, changes, focus=None):
+        '''`changes` is [ (start_line, end_line, text) ] in LSP order, 0-based lines'''
+        self.analysed_lines = 0
+        if not self.segments or any(change is None for change in changes):
+            return self.full(source, focus)
+
+        for start_line, end_line, text in changes:
+            self._apply(start_line+1, end_line+1, text.count('\n') - (end_line - start_line))
+        self.segments = [ seg for seg in self.segments if seg.end >= seg.start ]
+
+        if not self.segments or self.segments[-1].end != line_count(source):
+            return self.full(source, focus)
+        self.refresh(source, focus)
+
+    def refresh(self, source: str, focus=None, stop=None, chunk: int = None):
+        '''analyse the dirty segments, with `focus` only those overlapping its (first, last) lines.
+        Runs are at most `chunk` lines and `stop()` is checked before each; False if it stopped early.'''
+        lines = source.splitlines(keepends=True)
+        index = len(self.segments) - 1
+        while index >= 0:
+            if not self._wanted(index, focus):
+                index -= 1
+                continue
+            if stop is not None and stop(): return False
+            if not self._stale(index):
+                self._complete(lines, self.segments[index])
+                index -= 1
+                continue
+            first = index
+            while first > 0 and self._wanted(first-1, focus) and self._stale(first-1) and (
+                chunk is None or self.segments[index].end - self.segments[first-1].start < chunk
+            ):
+                first -= 1
+            widened = self._reanalyse(lines, first, index)
+            if widened is None:
+                if parse(source) is not None:
+                    # only broken as a region, e.g. a bracket opened in one segment and closed in another
+                    self.full(source)
+                    return True
+                start, end = self.segments[first].start, self.segments[index].end
+                self.segments[first:index+1] = self._recover(lines, start, end, self.segments[first:index+1])
+            else:
+                first = widened
+            index = first - 1
+        return True
+
+    @property
+    def dirty(self):
+        '''whether some segment is not analysed, or not with every rule'''
+        return any( seg.matches is None or seg.missing for seg in self.segments )
+
+    @property
+    def broken(self):
+        return any( seg.broken for seg in self.segments )
+
+    def snapshot(self):
+        '''immutable copy of the segments, to `restore` for identical source'''
+        return tuple( (seg.start, seg.end, seg.block, tuple(seg.matches.rows() if seg.matches else ()))
+            for seg in self.segments
+        )
+
+    def restore(self, snapshot):
+        self.analysed_lines = 0
+        self.segments = [ Segment(start, end, block, MatchStore.from_rows(matches, self.rules or ()))
+            for start, end, block, matches in snapshot
+        ]
+
+    def matches(self):
+        '''MatchStore of the whole document'''
+        found = MatchStore(self.rules or ())
+        for seg in self.segments:
+            found.extend(seg.previous(), seg.start)
+        return found
+
+    def _wanted(self, index: int, focus):
+        seg = self.segments[index]
+        if not self._stale(index) and not seg.missing: return False
+        return focus is None or (seg.start <= focus[1] and seg.end >= focus[0])
+
+    def _stale(self, index: int):
+        '''whether the segment has to be analysed again, not just have missing rules run'''
+        seg = self.segments[index]
+        return seg.matches is None or seg.broken
+
+    def _complete(self, lines, seg: Segment):
+        '''run the rules missing from `seg` on it alone, keeping its matches in rule order'''
+        source = ''.join(lines[seg.start-1:seg.end])
+        tree = parse(source)
+        if tree is None: return
+        subset = tuple( sub for sub in self.rules if sub.name in seg.missing )
+        skipped = len(self.budget.skipped) if self.budget is not None else 0
+        rows = seg.matches.rows()
+        for match, sub in self.analyse(source, tree, subset):
+            text_range = match.text_range
+            rows.append((text_range.from_line - 1, text_range.from_offset,
+                text_range.to_line - 1, text_range.to_offset, sub))
+        order = { sub.name: position for position, sub in enumerate(self.rules) }
+        rows.sort(key=lambda row: order[row[4].name])
+        seg.matches = MatchStore.from_rows(rows, self.rules)
+        seg.missing = self._skipped(skipped)
+        self.analysed_lines += seg.end - seg.start + 1
+
+    def _skipped(self, since: int):
+        '''names of the rules the budget skipped after its first `since`'''
+        if self.budget is None: return ()
+        return frozenset(self.budget.skipped[since:])
+
+    def _find(self, line: int):
+        starts = [ seg.start for seg in self.segments ]
+        return max(0, min(bisect_right(starts, line) - 1, len(self.segments) - 1))
+
+    def _apply(self, first_line: int, last_line: int, delta: int):
+        i, j = self._find(first_line), self._find(last_line)
+        merged = Segment(self.segments[i].start, self.segments[j].end + delta, False)
+        merged.block = any(seg.block for seg in self.segments[i:j+1])
+        merged.stale = MatchStore(self.rules or ())
+        for seg in self.segments[i:j+1]:
+            merged.stale.extend(seg.previous(), seg.start - merged.start)
+        for seg in self.segments[j+1:]:
+            seg.shift(delta)
+        self.segments[i:j+1] = [ merged ]
+
+    def _reanalyse(self, lines, first: int, last: int):
+        '''analyse segments `first`..`last` again, widened over neighbouring statements that now
+        join them; the index of the first segment replaced, or None if they do not parse'''
+        segments = self.segments
+        while True:
+            start, end = segments[first].start, segments[last].end
+            source = ''.join(lines[start-1:end])
+            tree = parse(source)
+            if tree is None: return None
+
+            leading, trailing = _first_kind(tree), _last_kind(tree)
+            if first > 0 and leading is False and not segments[first-1].block:
+                first -= 1
+                continue
+            if last < len(segments) - 1 and trailing is False and not segments[last+1].block:
+                last += 1
+                continue
+            break
+
+        self.analysed_lines += end - start + 1
+        segments[first:last+1] = self._analyse(source, tree, start, end)
+        return first
+
+    def _recover(self, lines, start: int, end: int, previous):
+        '''segments for lines `start`..`end`, which do not parse as a whole, taking
+        the matches of broken blocks from the `previous` segments on those lines'''
+        found = MatchStore(self.rules or ())
+        for seg in previous:
+            found.extend(seg.previous(), seg.start)
+        found = found.rows()
+        segments = []
+        for first, last in _blocks(lines, start, end):
+            source = ''.join(lines[first-1:last])
+            tree = parse(source)
+            if tree is not None:
+                self.analysed_lines += last - first + 1
+                segments.extend(self._analyse(source, tree, first, last))
+                continue
+            seg = Segment(first, last, False, MatchStore.from_rows(((from_line - first, from_offset, to_line - first, to_offset, sub)
+                for from_line, from_offset, to_line, to_offset, sub in found if first <= from_line <= last), self.rules or ()))
+            seg.broken = True
+            segments.append(seg)
+        return segments
+
+    def _analyse(self, source: str, tree: ast.Module, start: int, end: int):
+        '''segments covering lines `start`..`end` of the document, `tree` being their parse'''
+        segments = _split(tree, start, end, self.rules)
+
+        starts = [ seg.start for seg in segments ]
+        offset = start - 1
+        skipped = len(self.budget.skipped) if self.budget is not None else 0
+        found = self.analyse(source, tree)
+        missing = self._skipped(skipped)
+        for seg in segments:
+            seg.missing = missing
+        for match, sub in found:
+            text_range = match.text_range
+            seg = segments[max(0, bisect_right(starts, text_range.from_line + offset) - 1)]
+            relative = offset - seg.start
+            seg.matches.append(
+                text_range.from_line + relative, text_range.from_offset,
+                text_range.to_line + relative, text_range.to_offset, sub,
+            )
+        return segments
+
+
+def _split(tree: ast.Module, start: int, end: int, rules=None):
+    '''empty segments for lines `start`..`end`, `tree` being their parse'''
+    segments = []
+    for node in tree.body:
+        block = isinstance(node, BLOCKS)
+        if segments and not block and not segments[-1].block: continue
+        line = min([ node.lineno ] + [ d.lineno for d in getattr(node, 'decorator_list', ()) ])
+        segments.append(Segment(line + start - 1, 0, block, MatchStore(rules or ())))
+    if not segments:
+        segments.append(Segment(start, 0, False, MatchStore(rules or ())))
+    segments[0].start = start
+    for seg, following in zip(segments, segments[1:]):
+        seg.end = following.start - 1
+    segments[-1].end = end
+    return segments
+
+
+def _blocks(lines, start: int, end: int):
+    '''(first, last) lines of each top-level block in `start`..`end`, judged by indentation,
+    with decorators kept on their definition and runs of other statements kept together'''
+    blocks = []
+    kind = None  # of the block being built: 'decorator', 'block' or 'statements'
+    for number in range(start, end + 1):
+        line = lines[number-1] if number <= len(lines) else ''
+        if blocks and CONTINUATION.match(line):
+            blocks[-1][1] = number
+            continue
+        this = 'decorator' if line.startswith('@') else 'block' if BLOCK_START.match(line) else 'statements'
+        if blocks and (kind == 'decorator' and this != 'statements' or kind == this == 'statements'):
+            blocks[-1][1] = number
+        else:
+            blocks.append([ number, number ])
+        kind = 'block' if kind == 'decorator' and this == 'block' else this
+    return [ tuple(block) for block in blocks ]
+
+
+def line_count(source: str):
+    return source.count('\n') + 1
+
+
+def _first_kind(tree: ast.Module):
+    return isinstance(tree.body[0], BLOCKS) if tree.body else None
+
+
+def _last_kind(tree: ast.Module):
+    return isinstance(tree.body[-1], BLOCKS) if tree.body else None
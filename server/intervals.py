@@ -0,0 +1,77 @@
+'''
+Static interval index over match ranges.
+
+Intervals are sorted by start and kept in a max-end segment tree, so the
+ranges containing a position are found in O(log n + k) for k results.
+Positions are LSP ones: 0-based lines, character offsets included.
+'''
+
+from array import array
+from bisect import bisect_right
+
+from .matches import MatchStore
+
+_CHARACTER_BITS = 24
+
+
+def key(line: int, character: int):
+    return (line << _CHARACTER_BITS) | min(character, (1 << _CHARACTER_BITS) - 1)
+
+
+def range_keys(text_range):
+    '''qChecker `TextRange` (1-based lines) as a pair of position keys'''
+    return (
+        key(text_range.from_line-1, text_range.from_offset),
+        key(text_range.to_line-1, text_range.to_offset),
+    )
+
+
+class IntervalIndex:
+
+    def __init__(self, items):
+        '''`items` are (text_range, value) pairs or a `MatchStore`; lookups keep their order'''
+        if isinstance(items, MatchStore):
+            keys = ( (key(from_line-1, from_offset), key(to_line-1, to_offset))
+                for from_line, from_offset, to_line, to_offset in items.ranges()
+            )
+        else:
+            items = list(items)
+            keys = ( range_keys(text_range) for text_range, _ in items )
+        entries = sorted( pair + (order,) for order, pair in enumerate(keys) )
+        self.items = items
+        self.starts = array('q', [ start for start, _, _ in entries ])
+        self.ends = array('q', [ end for _, end, _ in entries ])
+        self.orders = array('l', [ order for _, _, order in entries ])
+
+        self.size = 1
+        while self.size < len(entries):
+            self.size *= 2
+        self.max_end = array('q', [ -1 ]) * (2 * self.size)
+        self.max_end[self.size:self.size+len(entries)] = self.ends
+        for node in range(self.size - 1, 0, -1):
+            self.max_end[node] = max(self.max_end[2*node], self.max_end[2*node+1])
+
+    def __len__(self):
+        return len(self.items)
+
+    def at(self, line: int, character: int):
+        '''every (text_range, value) containing the position, in insertion order'''
+        point = key(line, character)
+        count = bisect_right(self.starts, point)
+        found = []
+        if count:
+            self._collect(1, 0, self.size, count, point, found)
+        return [ self.items[order] for order in sorted(found) ]
+
+    def first(self, line: int, character: int):
+        found = self.at(line, character)
+        return found[0] if found else None
+
+    def _collect(self, node, low, high, count, point, found):
+        if low >= count or self.max_end[node] < point: return
+        if high - low == 1:
+            found.append(self.orders[low])
+            return
+        middle = (low + high) // 2
+        self._collect(2*node, low, middle, count, point, found)
+        self._collect(2*node+1, middle, high, count, point, found)
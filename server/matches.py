@@ -0,0 +1,121 @@
+'''
+Compact store of matches.
+
+A store keeps its matches as parallel arrays of ints, the range (lines as
+qChecker numbers them) and an index into the store's own list of rules, so
+a match costs 18 bytes rather than a tuple, a `TextRange` and its ints.
+`TextRange`s and LSP objects are only made for the matches handed out, e.g.
+by hover or when diagnostics are published.
+'''
+
+from array import array
+
+from qchecker.match import TextRange
+
+
+class MatchStore:
+    __slots__ = ('rules', 'indexes', 'from_lines', 'from_offsets', 'to_lines', 'to_offsets', 'rule_indexes')
+
+    def __init__(self, rules=()):
+        self.rules = []
+        self.indexes = {}  # { rule name: index in `rules` }
+        self.from_lines = array('i')
+        self.from_offsets = array('i')
+        self.to_lines = array('i')
+        self.to_offsets = array('i')
+        self.rule_indexes = array('H')
+        for rule in rules:
+            self._rule_index(rule)
+
+    @classmethod
+    def from_rows(cls, rows, rules=()):
+        '''store of (from_line, from_offset, to_line, to_offset, rule) rows'''
+        store = cls(rules)
+        for row in rows:
+            store.append(*row)
+        return store
+
+    @classmethod
+    def from_matches(cls, matches, rules=()):
+        '''store of (text_range, rule) pairs'''
+        return cls.from_rows(((text_range.from_line, text_range.from_offset,
+            text_range.to_line, text_range.to_offset, rule) for text_range, rule in matches), rules)
+
+    def append(self, from_line: int, from_offset: int, to_line: int, to_offset: int, rule):
+        self.from_lines.append(from_line)
+        self.from_offsets.append(from_offset)
+        self.to_lines.append(to_line)
+        self.to_offsets.append(to_offset)
+        self.rule_indexes.append(self._rule_index(rule))
+
+    def extend(self, other, delta: int = 0):
+        '''append the matches of `other`, their lines moved by `delta`'''
+        if not other: return
+        if delta:
+            self.from_lines.extend( line + delta for line in other.from_lines )
+            self.to_lines.extend( line + delta for line in other.to_lines )
+        else:
+            self.from_lines.extend(other.from_lines)
+            self.to_lines.extend(other.to_lines)
+        self.from_offsets.extend(other.from_offsets)
+        self.to_offsets.extend(other.to_offsets)
+        mapping = [ self._rule_index(rule) for rule in other.rules ]
+        if mapping == list(range(len(mapping))):
+            self.rule_indexes.extend(other.rule_indexes)
+        else:
+            self.rule_indexes.extend( mapping[index] for index in other.rule_indexes )
+
+    def rows(self):
+        '''(from_line, from_offset, to_line, to_offset, rule) for every match'''
+        rules = self.rules
+        return [ (from_line, from_offset, to_line, to_offset, rules[index])
+            for from_line, from_offset, to_line, to_offset, index in zip(self.from_lines,
+                self.from_offsets, self.to_lines, self.to_offsets, self.rule_indexes)
+        ]
+
+    def ranges(self):
+        return zip(self.from_lines, self.from_offsets, self.to_lines, self.to_offsets)
+
+    def diagnostics(self, make):
+        '''`make(text_range, rule)` for every match'''
+        return [ make(text_range, rule) for text_range, rule in self ]
+
+    def nbytes(self):
+        return sum( len(column) * column.itemsize for column in (self.from_lines,
+            self.from_offsets, self.to_lines, self.to_offsets, self.rule_indexes) )
+
+    def __len__(self):
+        return len(self.rule_indexes)
+
+    def __getitem__(self, index: int):
+        '''the match as a (text_range, rule) pair'''
+        return (
+            TextRange(self.from_lines[index], self.from_offsets[index], self.to_lines[index], self.to_offsets[index]),
+            self.rules[self.rule_indexes[index]],
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, MatchStore): return NotImplemented
+        if not (self.from_lines == other.from_lines and self.from_offsets == other.from_offsets
+                and self.to_lines == other.to_lines and self.to_offsets == other.to_offsets):
+            return False
+        if list(self.indexes) == list(other.indexes):
+            return self.rule_indexes == other.rule_indexes
+        return [ self.rules[index].name for index in self.rule_indexes ] \
+            == [ other.rules[index].name for index in other.rule_indexes ]
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'MatchStore({self.rows()!r})'
+
+    def _rule_index(self, rule):
+        index = self.indexes.get(rule.name)
+        if index is None:
+            index = self.indexes[rule.name] = len(self.rules)
+            self.rules.append(rule)
+        return index
@@ -0,0 +1,47 @@
+'''
+publishDiagnostics notifications serialised straight from a `MatchStore`.
+
+Everything in a diagnostic but its range depends on the rule alone, so that
+part is serialised once per rule and each match only adds its four ints.
+The JSON is what pygls sends for the same `Diagnostic`s, without building
+and validating a pydantic model per match first.
+'''
+
+import json
+
+METHOD = 'textDocument/publishDiagnostics'
+
+RANGE = '{"range":{"start":{"line":%d,"character":%d},"end":{"line":%d,"character":%d}}'
+
+
+class DiagnosticEncoder:
+
+    def __init__(self, source: str, severity: int):
+        self.source = source
+        self.severity = severity
+        self.tails = {}  # { rule name: the diagnostic's JSON after its range }
+
+    def diagnostics(self, matches):
+        '''JSON array of the diagnostics for `matches`'''
+        tails = [ self._tail(rule) for rule in matches.rules ]
+        return '[' + ','.join( RANGE % (from_line-1, from_offset, to_line-1, to_offset) + tails[index]
+            for from_line, from_offset, to_line, to_offset, index in zip(matches.from_lines,
+                matches.from_offsets, matches.to_lines, matches.to_offsets, matches.rule_indexes)
+        ) + ']'
+
+    def params(self, uri: str, matches, version: int = None):
+        '''with the document `version` the diagnostics are for, if given'''
+        version = '' if version is None else ',"version":%d' % version
+        return '{"uri":%s%s,"diagnostics":%s}' % (json.dumps(uri), version, self.diagnostics(matches))
+
+    def notification(self, uri: str, matches, version: int = None):
+        '''the whole JSON-RPC message, encoded'''
+        return ('{"jsonrpc":"2.0","method":"%s","params":%s}' % (METHOD, self.params(uri, matches, version))).encode()
+
+    def _tail(self, rule):
+        tail = self.tails.get(rule.name)
+        if tail is None:
+            tail = self.tails[rule.name] = ',"message":%s,"severity":%d,"code":%s,"source":%s}' % (
+                json.dumps(rule.name), self.severity, json.dumps(rule.technical_description), json.dumps(self.source),
+            )
+        return tail
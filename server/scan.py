@@ -0,0 +1,108 @@
+'''
+Batch scanning of whole directories on a process pool.
+
+Files are handed to workers in small chunks and results are yielded as
+soon as each chunk finishes, with a bounded number of chunks in flight, so
+memory stays flat however many files there are. Results only hold plain
+tuples and rule names, which keeps the traffic between processes small.
+A file that cannot be read or analysed gets a result with its error, and
+the scan carries on.
+'''
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+SKIP_DIRECTORIES = { '.git', '.hg', '.svn', '.tox', '.nox', '.venv', 'venv', 'node_modules', '__pycache__' }
+CHUNK_SIZE = 16
+IN_FLIGHT_PER_WORKER = 4
+
+
+class FileResult:
+    __slots__ = ('path', 'matches', 'error')
+
+    def __init__(self, path: str, matches, error: str = None):
+        self.path = path
+        self.matches = matches  # [ (from_line, from_offset, to_line, to_offset, rule name) ]
+        self.error = error
+
+
+def iter_python_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, directories, files in os.walk(path):
+            directories[:] = sorted(d for d in directories
+                if d not in SKIP_DIRECTORIES and not d.startswith('.')
+            )
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    yield os.path.join(root, name)
+
+
+def analyse_source(source: str, substructures):
+    from .engine import find_matches
+    return [ (m.text_range.from_line, m.text_range.from_offset, m.text_range.to_line, m.text_range.to_offset, sub.name)
+        for m, sub in find_matches(source, substructures, fused=True)
+    ]
+
+
+def analyse_file(path: str, substructures):
+    try:
+        with open(path, encoding='utf-8', errors='surrogateescape') as file:
+            source = file.read()
+    except OSError as e:
+        return FileResult(path, [], str(e))
+    try:
+        return FileResult(path, analyse_source(source, substructures))
+    except Exception as e:
+        # one pathological file must not end the scan of all the others
+        return FileResult(path, [], f'analysis failed: {e!r}')
+
+
+def _substructures(rule_names):
+    from qchecker.substructures import SUBSTRUCTURES
+    if rule_names is None: return list(SUBSTRUCTURES)
+    rule_names = set(rule_names)
+    return [ sub for sub in SUBSTRUCTURES if sub.name in rule_names ]
+
+
+def _analyse_chunk(paths, rule_names):
+    substructures = _substructures(rule_names)
+    return [ analyse_file(path, substructures) for path in paths ]
+
+
+def _chunks(paths, size: int):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan(paths, rule_names=None, workers: int = None, chunk_size: int = CHUNK_SIZE, context=None):
+    '''yield a `FileResult` per python file under `paths`, in completion order;
+    `context` is the multiprocessing context the workers are started with'''
+    files = iter_python_files(paths)
+    if workers == 1:
+        substructures = _substructures(rule_names)
+        for path in files:
+            yield analyse_file(path, substructures)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunks(files, chunk_size)
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        pending = set()
+        while True:
+            for chunk in chunks:
+                pending.add(pool.submit(_analyse_chunk, chunk, rule_names))
+                if len(pending) >= workers * IN_FLIGHT_PER_WORKER: break
+            if not pending: return
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
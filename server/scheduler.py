@@ -0,0 +1,107 @@
+'''
+Debounced, per-document validation scheduling.
+
+Each document has at most one validation task. Scheduling a newer version
+drops the pending one (coalesced) or cancels the running one (cancelled).
+Content changes of dropped runs are carried over so incremental analysis
+still sees every edit, in order.
+
+A run that has called `commit` has started applying its changes, typically
+on a worker thread, and is left to finish; its results are simply never
+published. The next run for that document waits for it first.
+'''
+
+import asyncio
+
+FULL = None  # changes value asking for a full re-analysis
+
+
+class ValidationScheduler:
+
+    def __init__(self, validate, debounce: float = 0.15):
+        '''`validate(document, changes, version)` is a coroutine function'''
+        self.validate = validate
+        self.debounce = debounce
+        self.tasks = {}
+        self.changes = {}
+        self.running = set()
+        self.committed = set()
+        self.scheduled = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.completed = 0
+
+    def schedule(self, document, changes=FULL, delay: float = None):
+        uri = document.uri
+        self.changes[uri] = _merge(self.changes.get(uri, []), changes)
+        previous = self.cancel(uri)
+        self.scheduled += 1
+        self.tasks[uri] = asyncio.ensure_future(
+            self._run(document, self.debounce if delay is None else delay, previous)
+        )
+        return self.tasks[uri]
+
+    def cancel(self, uri: str):
+        '''stop the document's run, returning it if it has to be waited for'''
+        task = self.tasks.pop(uri, None)
+        if task is None or task.done(): return None
+        if task in self.running:
+            self.cancelled += 1
+        else:
+            self.coalesced += 1
+        if task in self.committed:
+            return task
+        task.cancel()
+        return None
+
+    def commit(self):
+        '''called by `validate` once the current run may no longer be cancelled'''
+        self.committed.add(asyncio.current_task())
+
+    async def idle(self, uri: str):
+        '''wait until no run is scheduled for the document'''
+        task = self.tasks.get(uri)
+        while task is not None:
+            await asyncio.wait({ task })
+            task = self.tasks.get(uri)
+
+    def forget(self, uri: str):
+        self.cancel(uri)
+        self.changes.pop(uri, None)
+
+    def stats(self):
+        return {
+            'scheduled': self.scheduled,
+            'coalesced': self.coalesced,
+            'cancelled': self.cancelled,
+            'completed': self.completed,
+        }
+
+    async def _run(self, document, delay: float, previous=None):
+        if delay:
+            await asyncio.sleep(delay)
+        if previous is not None:
+            await asyncio.wait({ previous })
+
+        task = asyncio.current_task()
+        changes = self.changes.pop(document.uri, FULL)
+        self.running.add(task)
+        try:
+            await self.validate(document, changes, getattr(document, 'version', None))
+            self.completed += 1
+        except asyncio.CancelledError:
+            if task in self.committed: raise
+            # hand the edits this run never applied to whichever run replaced it
+            self.changes[document.uri] = _merge(changes, self.changes.get(document.uri, []))
+            raise
+        finally:
+            self.running.discard(task)
+            self.committed.discard(task)
+            if self.tasks.get(document.uri) is task:
+                del self.tasks[document.uri]
+
+
+def _merge(earlier, later):
+    if earlier is FULL or later is FULL:
+        return FULL
+    return list(earlier) + list(later)
@@ -1,5 +1,16 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from pygls.lsp import LSP_METHODS_MAP
 from pygls.lsp.methods import (
     HOVER,
+    INITIALIZED,
     TEXT_DOCUMENT_DID_CHANGE,
     TEXT_DOCUMENT_DID_CLOSE,
     TEXT_DOCUMENT_DID_OPEN,
@@ -21,65 +32,550 @@ from pygls.lsp.types import (
     Position,
     Range,
     TextDocumentIdentifier,
+    TextDocumentSyncKind,
 )
+from pygls.protocol import LanguageServerProtocol
 from pygls.server import LanguageServer
 
-from qchecker.substructures import (
-    SUBSTRUCTURES,
-    Substructure,
-)
 from qchecker.match import TextRange
 
+from .cache import (
+    DiskCache,
+    ResultCache,
+    content_key,
+    decode_snapshot,
+    encode_snapshot,
+    fingerprint,
+)
+from .diagnostics import PublishedDiagnostics
+from .engine import CHEAP_RULES, Budget, find_matches
+from .incremental import IncrementalAnalysis, line_count
+from .intervals import IntervalIndex
+from .matches import MatchStore
+from .payload import DiagnosticEncoder
+from .stats import Instrumentation
+from .scheduler import ValidationScheduler
+from .store import DocumentStore
+
+if TYPE_CHECKING:
+    from qchecker.substructures import Substructure
+
+# run through every rule once after initialize, so the first real document does not pay for it
+WARM_UP_SOURCE = '''\
+def warm_up(x, y):
+    if x > y:
+        return True
+    elif not x == y:
+        x = x + 1
+    else:
+        return False
+    for i in range(x):
+        y = y * y * y
+    return abs(x) if x < 0 or x > 0 else -x
+'''
+
 
 class PyDeodoriserServer(LanguageServer):
 
     CMD_SHOW_CONFIGURATION_ASYNC = 'showConfigurationAsync'
+    CMD_SCAN_WORKSPACE = 'deodorant.scanWorkspace'
+    STATS_REQUEST = 'deodorant/stats'
+    VISIBLE_RANGES_NOTIFICATION = 'deodorant/visibleRanges'
+    DIAGNOSTIC_REQUEST = 'textDocument/diagnostic'
     CONFIGURATION_SECTION = 'Deodorant'
     DIAGNOSTIC_SOURCE = 'Deodorant'
+    FUSED_VISITOR = True
+    FAST_PUBLISH = True  # write publishDiagnostics from the match store, not through pydantic
+    DEFAULT_DEBOUNCE_MS = 150
+    DEFAULT_CACHE_SIZE_MB = 64
+    DEFAULT_RULE_BUDGET_MS = 1000
+    DEFAULT_DOCUMENT_BUDGET_MS = 3000
+    DEFAULT_WORKERS = 1
+    DEFAULT_PROGRESSIVE_LINES = 5000
+    VIEWPORT_MARGIN = 50  # lines around the visible range analysed with it
+    BACKGROUND_CHUNK_LINES = 1000  # lines analysed between checks for newer edits
+    CONFIG_TTL = None  # seconds before the cached configuration is fetched again, None for never
+    PERSIST_IDLE = 2.0  # seconds without a newer result before a document's latest one is written to disk
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, loop=None, protocol_cls=LanguageServerProtocol):
+        super().__init__(loop, protocol_cls)
+        self.sync_kind = TextDocumentSyncKind.INCREMENTAL
         self.substructure_config = {}
-        self.substructures = { sub.name: sub for sub in SUBSTRUCTURES }
-        self.document = None
-        self.matches = None
+        self._substructures = None
+        self.enabled = []
+        self.fingerprints = {}
+        self.rule_budget = PyDeodoriserServer.DEFAULT_RULE_BUDGET_MS / 1000
+        self.document_budget = PyDeodoriserServer.DEFAULT_DOCUMENT_BUDGET_MS / 1000
+        self.large_file_lines = 0
+        self.large_file_rules = set(CHEAP_RULES)
+        self.progressive_lines = PyDeodoriserServer.DEFAULT_PROGRESSIVE_LINES
+        self.config_time = None
+        self.config_request = None  # the workspace/configuration request in flight, for everyone to wait on
+        self.results = ResultCache()
+        self.disk_cache = None
+        self.disk_writer = None  # the one thread the disk cache is written from
+        self.stats = Instrumentation()
+        self.stats_interval = 0
+        self.stats_logged_at = time.monotonic()
+        self.documents = DocumentStore()
+        self.encoder = DiagnosticEncoder(PyDeodoriserServer.DIAGNOSTIC_SOURCE, DiagnosticSeverity.Warning)
+        self.published = PublishedDiagnostics(self._make_diagnostic, self.encoder)
+        self.warm_up_enabled = True
+        self.started = time.perf_counter()  # overridden with the process start by __main__
+        self.startup = {}
+        self.pull_diagnostics = False
+        self.workers = PyDeodoriserServer.DEFAULT_WORKERS
+        self.pool = None
+        self.daemon = None  # the `Daemon` this is one client's server of, which owns the pool and cache
+        self.scheduler = ValidationScheduler(
+            self.validate_async, PyDeodoriserServer.DEFAULT_DEBOUNCE_MS / 1000
+        )
+
+    @property
+    def substructures(self):
+        '''every qChecker substructure by name, imported on first use'''
+        if self._substructures is None:
+            from qchecker.substructures import SUBSTRUCTURES
+            self._substructures = { sub.name: sub for sub in SUBSTRUCTURES }
+        return self._substructures
+
+    async def initialized(self):
+        '''fetch the configuration and warm up the rules while the client opens its documents'''
+        self.startup_time('initialized_ms')
+        await self.get_config_substructure()
+        if not self.warm_up_enabled: return
+        start = time.perf_counter()
+        await self._in_pool(self._warm_up)
+        self.startup['warm_up_ms'] = (time.perf_counter() - start) * 1e3
+
+    def _warm_up(self):
+        for match, sub in find_matches(WARM_UP_SOURCE, list(self.substructures.values()), fused=self.FUSED_VISITOR):
+            self._make_diagnostic(match.text_range, sub)
+        content_key(WARM_UP_SOURCE, fingerprint(self.enabled))
+
+    def startup_time(self, name: str):
+        if name in self.startup: return False
+        self.startup[name] = (time.perf_counter() - self.started) * 1e3
+        return True
+
+    def _first_diagnostics(self):
+        if not self.startup_time('first_diagnostic_ms'): return
+        self.show_message_log(f"Deodorant: first diagnostics {self.startup['first_diagnostic_ms']:.0f} ms after start")
 
-    async def get_config_substructure(self):
+    async def get_config_substructure(self, refresh: bool = False):
+        '''the configuration, asked for once however many runs need it at the same time'''
+        if not refresh and self._config_fresh(): return
+        if refresh or self.config_request is None:
+            self.config_request = asyncio.ensure_future(self._request_config())
+        # shielded: pygls fails on a response to a request whose future was cancelled,
+        # as it is when the document being validated closes before the client answers
+        await asyncio.shield(self.config_request)
+
+    async def _request_config(self):
         try:
             config = await self.get_configuration_async(
                 ConfigurationParams(items=[ ConfigurationItem(
                     scope_uri='', section=PyDeodoriserServer.CONFIGURATION_SECTION
                 )])
             )
-            self.substructure_config = config[0].get('substructures')
-            self.show_message_log(f'pyDeodoriser.substructures: {self.substructure_config}')
+            self.apply_config(config[0])
 
         except Exception as e:
             self.show_message_log(f'Config error: {e}')
+        finally:
+            if self.config_request is asyncio.current_task():
+                self.config_request = None
 
-
-    def validate(self, document: TextDocumentIdentifier):
-        self.document = self.workspace.get_document(document.uri)
-        if not self.document.source: return
-
-        self.matches = [ (match, sub)
+    def apply_config(self, config: dict):
+        self.substructure_config = config.get('substructures') or {}
+        self.scheduler.debounce = config.get('debounce', PyDeodoriserServer.DEFAULT_DEBOUNCE_MS) / 1000
+        self.enabled = [ sub
             for name, sub in self.substructures.items() if self.substructure_config.get(name)
-            for match in self._try_iter(sub, self.document.source)
         ]
-        diagnostics = [
-            self._make_diagnostic(match.text_range, substrcture)
-            for match, substrcture in self.matches
-        ]
-        self.publish_diagnostics(self.document.uri, diagnostics)
+        self.fingerprints = {}
+        self.rule_budget = _seconds(config.get('ruleBudgetMs', PyDeodoriserServer.DEFAULT_RULE_BUDGET_MS))
+        self.document_budget = _seconds(config.get('documentBudgetMs', PyDeodoriserServer.DEFAULT_DOCUMENT_BUDGET_MS))
+        self.large_file_lines = config.get('largeFileLines') or 0
+        self.large_file_rules = set(config.get('largeFileRules') or CHEAP_RULES)
+        self.progressive_lines = config.get('progressiveLines', PyDeodoriserServer.DEFAULT_PROGRESSIVE_LINES) or 0
+        for uri in self.documents:
+            self.documents.get(uri).skipped.clear()
+        self.configure_disk_cache(config.get('cacheDirectory'), config.get('cacheSizeMB'))
+        self.stats_interval = config.get('statsLogInterval') or 0
+        self.configure_pool(config.get('workers'))
+        if self.config_time is None:
+            # the client reads this setting once, when it starts, so the server does too
+            self.pull_diagnostics = bool(config.get('pullDiagnostics'))
+        self.config_time = time.monotonic()
+        self.show_message_log(f'pyDeodoriser.substructures: {self.substructure_config}')
 
+    def configure_disk_cache(self, directory: str = None, size_mb: float = None):
+        if not directory:
+            self.disk_cache = None
+            return
+        directory = os.path.expanduser(directory)
+        max_bytes = int((size_mb or PyDeodoriserServer.DEFAULT_CACHE_SIZE_MB) * 2**20)
+        if self.disk_cache is None or self.disk_cache.directory != directory:
+            self.disk_cache = DiskCache(directory, max_bytes)
+        self.disk_cache.max_bytes = max_bytes
 
-    def hover(self, position: Position):
-        hover_match = [ (match.text_range, substructure)
-            for match, substructure in self.matches if self._contains(match.text_range, position)
-        ]
+    def configure_pool(self, workers: int = None):
+        if self.daemon is not None:
+            self.pool = self.daemon.pool
+            return
+        workers = max(1, workers or PyDeodoriserServer.DEFAULT_WORKERS)
+        if workers == self.workers and self.pool is not None: return
+        if self.pool is not None:
+            # runs already handed to the old pool finish there
+            self.pool.shutdown(wait=False)
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='deodorant')
+
+    def _config_fresh(self):
+        if self.config_time is None: return False
+        ttl = PyDeodoriserServer.CONFIG_TTL
+        return ttl is None or time.monotonic() - self.config_time < ttl
+
+
+    async def validate_async(self, document: TextDocumentIdentifier, changes=None, version=None):
+        await self.get_config_substructure()
+        job = self._prepare(document, changes)
+        if job is None: return
+        if job.cached is None and await self.results.wait(job.key):
+            # the same content was being analysed, for another document or another client
+            job.cached = self.results.get(job.key)
+        with self.results.claim(job.key):
+            if job.cached is None:
+                # from here on the edits are being applied, the scheduler lets this run finish
+                self.scheduler.commit()
+                job.focus = self._focus(job)
+                if job.focus is None and self._progressive(job):
+                    job.progress = partial(self._progress, job, asyncio.get_event_loop())
+                await self._in_pool(self._analyse, job)
+            else:
+                self._analyse(job)
+            self._finish(job, version)
+        if job.state.analysis.dirty:
+            await self._background(job, version)
+
+    async def _background(self, job, version=None):
+        '''the rest of a focused run, given up as soon as a newer run is scheduled'''
+        task = asyncio.current_task()
+        job.budget = job.state.analysis.budget = Budget(self.rule_budget, self.document_budget)
+        stop = lambda: self.scheduler.tasks.get(job.state.uri) is not task
+        if await self._in_pool(self._refresh, job, stop):
+            self._finish(job, version)
+
+    async def _in_pool(self, function, *args):
+        if self.pool is None:
+            self.configure_pool(self.workers)
+        return await asyncio.get_event_loop().run_in_executor(self.pool, function, *args)
+
+
+    def validate(self, document: TextDocumentIdentifier, changes=None, version=None):
+        job = self._prepare(document, changes)
+        if job is None: return
+        self._analyse(job)
+        self._finish(job, version)
+
+    def _prepare(self, document: TextDocumentIdentifier, changes=None):
+        '''on the event loop: snapshot the document and decide what has to run'''
+        text_document = self.workspace.get_document(document.uri)
+        if not text_document.source:
+            self.documents.close(document.uri)
+            return None
+
+        state = self.documents.open(document.uri)
+        rules = self._rules_for(state, line_count(text_document.source))
+        if state.analysis is None or state.analysis.rules != rules:
+            state.analysis = IncrementalAnalysis(None, rules)
+            changes = None
+        if changes is not None:
+            changes = [ self._change_lines(change) for change in changes ]
+
+        key = content_key(text_document.source, self._fingerprint(rules))
+        job = Validation(state, text_document.source, text_document.version, changes,
+            Budget(self.rule_budget, self.document_budget), key, self.results.get(key))
+        # early matches are only shown from an analysis of the whole document: those of a part,
+        # e.g. a block recovered from a document that does not parse, are relative to that part
+        state.analysis.analyse = lambda source, tree, subset=rules: find_matches(
+            source, subset, tree, self.FUSED_VISITOR, self.stats, job.budget, CHEAP_RULES,
+            job.progress if source is job.source else None,
+        )
+        state.analysis.budget = job.budget
+        return job
+
+    def _analyse(self, job):
+        '''on a worker thread: everything that grows with the size of the document'''
+        analysis = job.state.analysis
+        if job.cached is None and self.disk_cache is not None:
+            job.cached = job.from_disk = self._disk_result(job.key)
+        if job.cached is not None:
+            analysis.restore(job.cached)
+        elif job.changes is None:
+            analysis.full(job.source, job.focus)
+        else:
+            analysis.update(job.source, job.changes, job.focus)
+        self._collect(job)
+
+    def _refresh(self, job, stop):
+        if not job.state.analysis.refresh(job.source, stop=stop, chunk=self.BACKGROUND_CHUNK_LINES):
+            return False
+        self._collect(job)
+        return True
+
+    def _collect(self, job):
+        job.matches = job.state.analysis.matches()
+        job.index = IntervalIndex(job.matches)
+        job.payload = self._payload(job.state.uri, job.matches, job.version)
+
+    def _payload(self, uri: str, matches, version: int = None):
+        '''on the worker: the notification a publish of `matches` would send, None if it would be skipped'''
+        if not self.FAST_PUBLISH or self.pull_diagnostics or self.published.same(uri, matches): return None
+        return self.encoder.notification(uri, matches, version)
+
+    def _finish(self, job, version=None):
+        '''back on the event loop: swap in the results and publish them'''
+        state = job.state
+        if job.cached is None:
+            if not job.budget.complete:
+                self._over_budget(state, job.budget)
+            elif not state.analysis.dirty and not state.analysis.broken:
+                # broken regions hold matches from earlier text, not ones for this content
+                self._store_result(state, job.key, state.analysis.snapshot())
+        elif job.from_disk is not None:
+            self.results.put(job.key, job.from_disk)
+
+        self._log_stats()
+        # closed or evicted while the worker was busy
+        if self.documents.get(state.uri) is not state: return
+        state.version = job.version
+        state.matches = job.matches
+        state.index = job.index
+        self.documents.update(state)
+        if version is not None and job.version != version: return
+        if self.workspace.get_document(state.uri).version != job.version: return
+        self._publish(state.uri, job.matches, job.payload, job.version)
+
+    def _publish(self, uri: str, matches, payload: bytes = None, version: int = None):
+        '''`payload` is the notification for `matches` when already serialised'''
+        if not self.published.changed(uri, matches): return
+        if self.pull_diagnostics and uri in self.documents: return  # the client asks when it needs them
+        self._send(uri, matches, payload, version)
+        self._first_diagnostics()
+
+    def _send(self, uri: str, matches, payload: bytes = None, version: int = None):
+        self.published.sent += 1
+        if self.FAST_PUBLISH and self.lsp.transport is not None:
+            self._write(payload if payload is not None else self.encoder.notification(uri, matches, version))
+        else:
+            self.publish_diagnostics(uri, matches.diagnostics(self._make_diagnostic))
+
+    def _write(self, body: bytes):
+        '''send a serialised message the way pygls' protocol sends its own'''
+        lsp = self.lsp
+        if lsp._send_only_body:
+            lsp.transport.write(body.decode(lsp.CHARSET))
+            return
+        header = f'Content-Length: {len(body)}\r\nContent-Type: {lsp.CONTENT_TYPE}; charset={lsp.CHARSET}\r\n\r\n'
+        lsp.transport.write(header.encode(lsp.CHARSET) + body)
+
+    async def pull(self, document: TextDocumentIdentifier, previous_result_id: str = None):
+        '''answer a textDocument/diagnostic request once the document's runs are done'''
+        if document.uri not in self.documents:
+            self.scheduler.schedule(document, delay=0)
+        await self.scheduler.idle(document.uri)
+        report = self.published.pull(document.uri, previous_result_id)
+        self._first_diagnostics()
+        return report
+
+
+    def set_viewport(self, uri: str, ranges):
+        if not ranges: return
+        evicted = uri not in self.documents
+        margin = PyDeodoriserServer.VIEWPORT_MARGIN
+        self.documents.open(uri).viewport = (
+            max(1, min( r.start.line for r in ranges ) + 1 - margin),
+            max( r.end.line for r in ranges ) + 1 + margin,
+        )
+        if evicted:
+            self._revalidate(uri)
+
+    def _revalidate(self, uri: str):
+        '''an open document evicted from the store: analyse it again rather than wait for an edit'''
+        if uri in self.workspace.documents and uri not in self.scheduler.tasks:
+            self.scheduler.schedule(TextDocumentIdentifier(uri=uri), delay=0)
+
+    def _focus(self, job):
+        '''the visible lines of a long document, analysed and published before the rest'''
+        if not self.progressive_lines or job.state.viewport is None: return None
+        if line_count(job.source) <= self.progressive_lines: return None
+        return job.state.viewport
+
+    def _progressive(self, job):
+        '''only a document's first full analysis, so there are no older results to flicker'''
+        return (self.progressive_lines and job.changes is None and job.state.index is None
+            and line_count(job.source) > self.progressive_lines)
+
+    def _progress(self, job, loop, found):
+        '''on the worker: the cheap rules are done, show their matches while the rest run'''
+        matches = MatchStore.from_matches(( (match.text_range, sub) for match, sub in found ), job.state.analysis.rules)
+        payload = self._payload(job.state.uri, matches, job.version)
+        loop.call_soon_threadsafe(self._publish_partial, job, matches, payload)
+
+    def _publish_partial(self, job, matches, payload):
+        if job.matches is not None: return  # the full result is already in
+        if self.documents.get(job.state.uri) is not job.state: return
+        if self.workspace.get_document(job.state.uri).version != job.version: return
+        self._publish(job.state.uri, matches, payload, job.version)
+
+    def _rules_for(self, state, lines: int):
+        rules = self.enabled
+        if self.large_file_lines and lines > self.large_file_lines:
+            rules = [ sub for sub in rules if sub.name in self.large_file_rules ]
+        return tuple( sub for sub in rules if sub.name not in state.skipped )
+
+    def _fingerprint(self, rules):
+        if rules not in self.fingerprints:
+            self.fingerprints[rules] = fingerprint(rules)
+        return self.fingerprints[rules]
+
+    def _over_budget(self, state, budget: Budget):
+        # the segments remember the rules skipped on them, later runs only make those up
+        state.skipped.update(budget.overrun)
+        if budget.overrun:
+            self.show_message_log(
+                f'Deodorant: {", ".join(budget.overrun)} went over its time budget on {state.uri}'
+                ' and is disabled for this document'
+            )
+        if budget.skipped:
+            self.show_message_log(
+                f'Deodorant: document time budget exhausted on {state.uri},'
+                f' skipped {", ".join(dict.fromkeys(budget.skipped))} for now'
+            )
+
+
+    def statistics(self):
+        return {
+            'rules': self.stats.snapshot(),
+            'scheduler': self.scheduler.stats(),
+            'cache': self.results.stats(),
+            'publish': self.published.stats(),
+            'startup': self.startup,
+            'daemon': self.daemon.stats() if self.daemon is not None else None,
+            'disk_cache': self.disk_cache.stats() if self.disk_cache else None,
+            'documents': {
+                'open': len(self.documents),
+                'estimated_bytes': self.documents.size,
+                'evictions': self.documents.evictions,
+            },
+        }
+
+    def _log_stats(self):
+        if not self.stats_interval: return
+        now = time.monotonic()
+        if now - self.stats_logged_at < self.stats_interval: return
+        self.stats_logged_at = now
+        self.show_message_log(self.stats.summary())
+
+    def _disk_result(self, key: str):
+        '''on the worker: the snapshot the disk cache holds for `key`, if any'''
+        data = self.disk_cache.get(key)
+        return decode_snapshot(data, self.substructures) if data is not None else None
+
+    def _store_result(self, state, key: str, snapshot):
+        self.results.put(key, snapshot)
+        if self.disk_cache is None: return
+        # only what the document settles on goes to disk, not every version typed on the way
+        opened = state.index is None
+        state.unsaved = (key, snapshot)
+        if state.persist is not None:
+            state.persist.cancel()
+        if opened:
+            self._persist(state)
+        else:
+            state.persist = asyncio.get_event_loop().call_later(self.PERSIST_IDLE, self._persist, state)
+
+    def _persist(self, state):
+        '''hand the document's latest result to the disk writer thread'''
+        if state.persist is not None:
+            state.persist.cancel()
+            state.persist = None
+        if state.unsaved is None or self.disk_cache is None: return
+        key, snapshot = state.unsaved
+        state.unsaved = None
+        if self.disk_writer is None:
+            self.disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='deodorant-cache')
+        self.disk_writer.submit(_write_snapshot, self.disk_cache, key, snapshot)
+
+
+    async def scan_workspace(self, workers: int = None):
+        '''analyse every python file in the workspace and publish as results arrive'''
+        from .scan import scan
+
+        root = self.workspace.root_path
+        if not root: return 0
+
+        loop = asyncio.get_event_loop()
+        rules = [ sub.name for sub in self.enabled ]
+        # forking a process with threads running can deadlock the child
+        context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        )
+        def run():
+            count = errors = 0
+            for result in scan([ root ], rules, workers, context=context):
+                loop.call_soon_threadsafe(self._publish_scan_result, result)
+                count += 1
+                errors += result.error is not None
+            return count, errors
+
+        count, errors = await loop.run_in_executor(None, run)
+        failed = f', {errors} could not be analysed' if errors else ''
+        self.show_message_log(f'Deodorant scanned {count} files in {root}{failed}')
+        return count
+
+    def _publish_scan_result(self, result):
+        if result.error is not None:
+            self.show_message_log(f'Deodorant: could not scan {result.path}: {result.error}')
+            return
+        uri = Path(result.path).resolve().as_uri()
+        if uri in self.documents or not result.matches: return
+        # sent without being kept in `published`: a workspace has far more files than are open
+        self._send(uri, MatchStore.from_rows(
+            match[:4] + (self.substructures[match[4]],) for match in result.matches
+        ))
+
+
+    def close(self, document: TextDocumentIdentifier):
+        self.scheduler.forget(document.uri)
+        state = self.documents.close(document.uri)
+        if state is not None:
+            self._persist(state)
+        if self.published.forget(document.uri) is not None and not self.pull_diagnostics:
+            self.publish_diagnostics(document.uri, [])
+
+    def disconnect(self):
+        '''the client has gone: stop its runs and drop its documents'''
+        for uri in set(self.scheduler.tasks) | set(self.documents):
+            self.scheduler.forget(uri)
+            state = self.documents.close(uri)
+            if state is not None:
+                self._persist(state)
+            self.published.forget(uri)
+
+
+    def hover(self, document: TextDocumentIdentifier, position: Position):
+        state = self.documents.get(document.uri)
+        if state is None:
+            self._revalidate(document.uri)
+            return
+        if state.index is None: return
+
+        hover_match = state.index.first(position.line, position.character)
         if not hover_match: return
 
-        text_range, substructure = hover_match[0]
+        text_range, substructure = hover_match
         content = MarkupContent(
             kind=MarkupKind.Markdown,
             value=substructure.description.content,
@@ -91,7 +587,7 @@ class PyDeodoriserServer(LanguageServer):
         return Hover(contents=content, range=hover_range)
 
     @staticmethod
-    def _make_diagnostic(text_range: TextRange, substructure: Substructure):
+    def _make_diagnostic(text_range: TextRange, substructure: 'Substructure'):
         diagnostic_range = Range(
             start=Position(line=text_range.from_line-1, character=text_range.from_offset),
             end=Position(line=text_range.to_line-1, character=text_range.to_offset),
@@ -105,46 +601,115 @@ class PyDeodoriserServer(LanguageServer):
         )
 
     @staticmethod
-    def _try_iter(substructure: Substructure, source: str):
-        try:
-            return substructure.iter_matches(source)
-        except:
-            return []
+    def _change_lines(change):
+        change_range = getattr(change, 'range', None)
+        if change_range is None: return None
+        return change_range.start.line, change_range.end.line, change.text
 
-    @staticmethod
-    def _contains(text_range: TextRange, position: Position):
-        return text_range.from_line <= position.line+1 <= text_range.to_line
 
+class Validation:
+    '''one validation run, handed from the event loop to a worker and back'''
+    __slots__ = ('state', 'source', 'version', 'changes', 'budget', 'key', 'cached', 'from_disk',
+                 'focus', 'progress', 'matches', 'index', 'payload')
 
-pyDeodoriser = PyDeodoriserServer()
+    def __init__(self, state, source, version, changes, budget, key, cached):
+        self.state = state
+        self.source = source
+        self.version = version
+        self.changes = changes
+        self.budget = budget
+        self.key = key
+        self.cached = cached
+        self.from_disk = None  # `cached`, when the worker read it from the disk cache
+        self.focus = None  # (first, last) lines to analyse ahead of the rest
+        self.progress = None  # called with the cheap rules' matches on a progressive run
+        self.matches = None  # MatchStore of the whole document
+        self.index = None
+        self.payload = None  # publishDiagnostics for `matches`, serialised on the worker if it will be sent
 
 
-@pyDeodoriser.feature(TEXT_DOCUMENT_DID_CHANGE)
-async def did_change(ls: PyDeodoriserServer, params: DidChangeTextDocumentParams):
+def _write_snapshot(disk_cache: DiskCache, key: str, snapshot):
+    disk_cache.put(key, encode_snapshot(snapshot))
+
+
+def _seconds(milliseconds):
+    return milliseconds / 1000 if milliseconds else None
+
+
+async def initialized(ls: PyDeodoriserServer, *args):
+    await ls.initialized()
+
+
+# plain functions run as their notification arrives, pygls makes tasks of coroutines:
+# a didClose right behind them would otherwise be handled first
+def did_change(ls: PyDeodoriserServer, params: DidChangeTextDocumentParams):
     """Text document did change notification."""
-    await ls.get_config_substructure()
-    ls.validate(params.text_document)
+    ls.scheduler.schedule(params.text_document, params.content_changes)
 
 
-@pyDeodoriser.feature(TEXT_DOCUMENT_DID_OPEN)
-async def did_open(ls: PyDeodoriserServer, params: DidOpenTextDocumentParams):
+def did_open(ls: PyDeodoriserServer, params: DidOpenTextDocumentParams):
     """Text document did open notification."""
-    await ls.get_config_substructure()
-    ls.validate(params.text_document)
+    ls.scheduler.schedule(params.text_document, delay=0)
 
 
-@pyDeodoriser.feature(TEXT_DOCUMENT_DID_CLOSE)
 def did_close(ls: PyDeodoriserServer, params: DidCloseTextDocumentParams):
-    ls.refresh(params.text_document)
+    ls.close(params.text_document)
 
 
-# NOTE: currently not being registered for unknown reasons
-@pyDeodoriser.feature(WORKSPACE_DID_CHANGE_CONFIGURATION)
 async def did_change_configuration(ls: PyDeodoriserServer, params: DidChangeConfigurationParams):
-    ls.show_message('Configuration Did Change')
+    settings = (params.settings or {}).get(PyDeodoriserServer.CONFIGURATION_SECTION)
+    if settings:
+        ls.apply_config(settings)
+    else:
+        await ls.get_config_substructure(refresh=True)
+    for uri in ls.documents:
+        ls.scheduler.schedule(TextDocumentIdentifier(uri=uri), delay=0)
+
+
+async def scan_workspace(ls: PyDeodoriserServer, *args):
     await ls.get_config_substructure()
+    return await ls.scan_workspace()
+
+
+def stats(ls: PyDeodoriserServer, *args):
+    return ls.statistics()
+
+
+# pygls answers a request with an error unless its result checks against the type
+# registered for the method, which requests it does not know have none of
+LSP_METHODS_MAP.setdefault(PyDeodoriserServer.STATS_REQUEST, (None, None, Any))
+
+
+def visible_ranges(ls: PyDeodoriserServer, params):
+    ls.set_viewport(params.textDocument.uri, params.ranges)
+
+
+async def pull_diagnostics(ls: PyDeodoriserServer, params):
+    return await ls.pull(params.textDocument, getattr(params, 'previousResultId', None))
+
+
+# pygls 0.11 predates pull diagnostics, so this request is not registered either
+LSP_METHODS_MAP.setdefault(PyDeodoriserServer.DIAGNOSTIC_REQUEST, (None, None, Any))
 
 
-@pyDeodoriser.feature(HOVER)
 def did_hover(ls: PyDeodoriserServer, params: HoverParams):
-    return ls.hover(params.position)
+    return ls.hover(params.text_document, params.position)
+
+
+def create_server(loop=None, protocol_cls=LanguageServerProtocol):
+    '''a server with the handlers above, one per client when running as a daemon'''
+    ls = PyDeodoriserServer(loop, protocol_cls)
+    ls.feature(INITIALIZED)(initialized)
+    ls.feature(TEXT_DOCUMENT_DID_CHANGE)(did_change)
+    ls.feature(TEXT_DOCUMENT_DID_OPEN)(did_open)
+    ls.feature(TEXT_DOCUMENT_DID_CLOSE)(did_close)
+    ls.feature(WORKSPACE_DID_CHANGE_CONFIGURATION)(did_change_configuration)
+    ls.command(PyDeodoriserServer.CMD_SCAN_WORKSPACE)(scan_workspace)
+    ls.feature(PyDeodoriserServer.STATS_REQUEST)(stats)
+    ls.feature(PyDeodoriserServer.VISIBLE_RANGES_NOTIFICATION)(visible_ranges)
+    ls.feature(PyDeodoriserServer.DIAGNOSTIC_REQUEST)(pull_diagnostics)
+    ls.feature(HOVER)(did_hover)
+    return ls
+
+
+pyDeodoriser = create_server()
@@ -0,0 +1,74 @@
+'''
+Per-substructure instrumentation accumulated across validations.
+
+Rules record from worker threads while the event loop takes snapshots.
+'''
+
+import threading
+
+
+class RuleStats:
+    __slots__ = ('calls', 'seconds', 'matches', 'errors', 'skipped')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.matches = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'total_ms': self.seconds * 1e3,
+            'mean_ms': self.seconds * 1e3 / self.calls if self.calls else 0.0,
+            'matches': self.matches,
+            'errors': self.errors,
+            'skipped': self.skipped,
+        }
+
+
+class Instrumentation:
+
+    def __init__(self):
+        self.rules = {}
+        self.lock = threading.Lock()
+
+    def _rule(self, name: str):
+        rule = self.rules.get(name)
+        if rule is None:
+            rule = self.rules[name] = RuleStats()
+        return rule
+
+    def record(self, name: str, seconds: float, matches: int, failed: bool = False):
+        with self.lock:
+            rule = self._rule(name)
+            rule.calls += 1
+            rule.seconds += seconds
+            rule.matches += matches
+            rule.errors += failed
+
+    def skip(self, name: str):
+        with self.lock:
+            self._rule(name).skipped += 1
+
+    def reset(self):
+        with self.lock:
+            self.rules.clear()
+
+    def _ordered(self):
+        with self.lock:
+            return sorted(self.rules.items(), key=lambda item: item[1].seconds, reverse=True)
+
+    def snapshot(self):
+        '''rules ordered from most to least total time'''
+        return { name: rule.as_dict() for name, rule in self._ordered() }
+
+    def summary(self, top: int = 5):
+        ordered = self._ordered()[:top]
+        rules = ', '.join(
+            f'{name} {rule.seconds * 1e3:.1f}ms/{rule.calls} calls/{rule.matches} matches'
+            + (f'/{rule.errors} errors' if rule.errors else '')
+            for name, rule in ordered
+        )
+        return f'Deodorant slowest rules: {rules or "none yet"}'
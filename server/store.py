@@ -0,0 +1,86 @@
+'''
+Per-document analysis state, bounded by document count and memory.
+
+The least recently used documents are dropped first. An evicted document
+only loses its cached analysis; its next validation starts from scratch, and
+the server schedules one when a hover or the viewport needs it before an edit.
+'''
+
+from collections import OrderedDict
+
+# rough per-object footprints used for the memory budget
+SEGMENT_BYTES = 200
+MATCH_BYTES = 80  # in the document and segment stores and the interval index
+
+
+class DocumentState:
+    __slots__ = ('uri', 'version', 'analysis', 'matches', 'index', 'skipped', 'viewport', 'unsaved', 'persist', 'size')
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.version = None
+        self.analysis = None
+        self.matches = []
+        self.index = None
+        self.skipped = set()  # rules that went over their time budget here
+        self.viewport = None  # (first, last) lines visible in the editor, 1-based
+        self.unsaved = None  # (key, snapshot) of the latest result not yet in the disk cache
+        self.persist = None  # timer handle writing `unsaved` once the document is idle
+        self.size = 0
+
+    def estimate_size(self):
+        segments = len(self.analysis.segments) if self.analysis else 0
+        return segments * SEGMENT_BYTES + len(self.matches) * MATCH_BYTES
+
+
+class DocumentStore:
+
+    def __init__(self, max_documents: int = 64, max_bytes: int = 64 * 2**20):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.states = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+
+    def __contains__(self, uri: str):
+        return uri in self.states
+
+    def __iter__(self):
+        return iter(list(self.states))
+
+    def __len__(self):
+        return len(self.states)
+
+    def get(self, uri: str):
+        state = self.states.get(uri)
+        if state is not None:
+            self.states.move_to_end(uri)
+        return state
+
+    def open(self, uri: str):
+        state = self.get(uri)
+        if state is None:
+            state = self.states[uri] = DocumentState(uri)
+            self._evict()
+        return state
+
+    def update(self, state: DocumentState):
+        '''recount `state` after its analysis changed'''
+        size = state.estimate_size()
+        self.size += size - state.size
+        state.size = size
+        self._evict()
+
+    def close(self, uri: str):
+        state = self.states.pop(uri, None)
+        if state is not None:
+            self.size -= state.size
+        return state
+
+    def _evict(self):
+        while len(self.states) > 1 and (
+            len(self.states) > self.max_documents or self.size > self.max_bytes
+        ):
+            uri = next(iter(self.states))
+            self.close(uri)
+            self.evictions += 1
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+from server.cache import (
+    DiskCache,
+    ResultCache,
+    content_key,
+    decode_snapshot,
+    encode_snapshot,
+    fingerprint,
+)
+
+
+def _rules(*names):
+    return [ SimpleNamespace(name=name) for name in names ]
+
+
+def test_key_depends_on_content_and_rules():
+    rules = fingerprint(_rules('Nested If', 'Else If'))
+    assert rules == fingerprint(_rules('Else If', 'Nested If'))
+    assert rules != fingerprint(_rules('Nested If'))
+    assert content_key('x = 1\n', rules) == content_key('x = 1\n', rules)
+    assert content_key('x = 1\n', rules) != content_key('x = 2\n', rules)
+
+
+def test_lru_eviction_and_stats():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.stats() == { 'entries': 2, 'hits': 2, 'misses': 1, 'hit_rate': 2 / 3, 'waits': 0 }
+
+
+def test_disk_cache_round_trip(tmp_path):
+    rule = SimpleNamespace(name='Nested If')
+    snapshot = ((1, 3, False, ()), (4, 9, True, ((1, 4, 3, 23, rule),)))
+    data = encode_snapshot(snapshot)
+
+    DiskCache(str(tmp_path)).put('abcd', data)
+    cache = DiskCache(str(tmp_path))
+    assert decode_snapshot(cache.get('abcd'), { 'Nested If': rule }) == snapshot
+    assert decode_snapshot(cache.get('abcd'), {}) is None
+    assert cache.get('missing') is None
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+
+
+def test_disk_cache_rejects_corrupt_entries(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.put('abcd', (1, 2))
+    with open(cache.path('abcd'), 'r+b') as file:
+        file.write(b'junk')
+    assert cache.get('abcd') is None
+
+
+def test_disk_cache_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1)
+    cache.put('aa01', (1,))
+    cache.put('aa02', (2,))
+    cache.evict()
+    assert cache.get('aa01') is None and cache.get('aa02') is None
+    assert cache.evictions == 2
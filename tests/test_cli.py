@@ -0,0 +1,98 @@
+import io
+import json
+from textwrap import dedent
+
+import pytest
+
+from server import cli, scan
+
+CODE = dedent('''
+def foo(x):
+    if x > 5:
+        return True
+    else:
+        return False
+''')
+
+DEEP = 'x = ' + '+'.join([ '1' ] * 5000) + '\n'
+
+
+def _run(*argv, stdin=None):
+    parser = cli.argparse.ArgumentParser()
+    cli.add_arguments(parser)
+    args = parser.parse_args([ *argv, '--workers', '1' ])
+    out, err = io.StringIO(), io.StringIO()
+    if stdin is not None:
+        args.paths = list(cli.iter_paths(args.paths, io.StringIO(stdin)))
+    return cli.run(args, out, err), out.getvalue(), err.getvalue()
+
+
+def test_jsonl(tmp_path):
+    (tmp_path / 'a.py').write_text(CODE)
+    (tmp_path / 'clean.py').write_text('print(1)\n')
+    status, out, _ = _run(str(tmp_path), '--format', 'jsonl')
+    records = [ json.loads(line) for line in out.splitlines() ]
+    assert status == cli.EXIT_MATCHES
+    assert records and all(r['path'] == str(tmp_path / 'a.py') for r in records)
+    assert { 'rule', 'code', 'line', 'column', 'endLine', 'endColumn' } <= set(records[0])
+
+
+def test_sarif_is_valid_json(tmp_path):
+    (tmp_path / 'a.py').write_text(CODE)
+    status, out, _ = _run(str(tmp_path), '--format', 'sarif')
+    run, = json.loads(out)['runs']
+    assert status == cli.EXIT_MATCHES
+    assert run['results'] and run['invocations'] == [ { 'executionSuccessful': True } ]
+    rules = run['tool']['driver']['rules']
+    assert all(rules[r['ruleIndex']]['id'] == r['ruleId'] for r in run['results'])
+
+
+def test_sarif_artifact_uris(tmp_path, monkeypatch):
+    (tmp_path / 'my lab').mkdir()
+    (tmp_path / 'my lab' / 'a.py').write_text(CODE)
+    _, out, _ = _run(str(tmp_path / 'my lab' / 'a.py'), '--format', 'sarif')
+    location, = { r['locations'][0]['physicalLocation']['artifactLocation']['uri'] for r in json.loads(out)['runs'][0]['results'] }
+    assert location == (tmp_path / 'my lab' / 'a.py').as_uri()
+
+    monkeypatch.chdir(tmp_path)
+    _, out, _ = _run('my lab', '--format', 'sarif')
+    location, = { r['locations'][0]['physicalLocation']['artifactLocation']['uri'] for r in json.loads(out)['runs'][0]['results'] }
+    assert location == 'my%20lab/a.py'
+
+
+def test_unknown_rule_is_rejected(tmp_path, capsys):
+    (tmp_path / 'a.py').write_text(CODE)
+    with pytest.raises(SystemExit) as exit:
+        cli.main([ str(tmp_path), '--rule', 'Nested If', '--rule', 'Nested Iff' ])
+    assert exit.value.code == 2
+    assert "unknown --rule 'Nested Iff'" in capsys.readouterr().err
+
+
+def test_sarif_without_results(tmp_path):
+    (tmp_path / 'clean.py').write_text('print(1)\n')
+    status, out, _ = _run(str(tmp_path), '--format', 'sarif')
+    assert status == cli.EXIT_CLEAN
+    assert json.loads(out)['runs'][0]['results'] == []
+
+
+def test_paths_from_stdin_and_errors(tmp_path):
+    (tmp_path / 'a.py').write_text(CODE)
+    status, out, err = _run('-', stdin=f'{tmp_path / "a.py"}\n\n{tmp_path / "missing.py"}\n')
+    assert status == cli.EXIT_ERROR
+    assert out.startswith(f'{tmp_path / "a.py"}:')
+    assert 'missing.py: error:' in err
+
+
+def test_failing_file_does_not_end_the_run(tmp_path, monkeypatch):
+    for name, code in (('a.py', CODE), ('b.py', DEEP), ('c.py', CODE)):
+        (tmp_path / name).write_text(code)
+    analyse = scan.analyse_source
+    def analyse_or_fail(source, substructures):
+        if source == DEEP: raise RecursionError('maximum recursion depth exceeded')
+        return analyse(source, substructures)
+
+    monkeypatch.setattr(scan, 'analyse_source', analyse_or_fail)
+    status, out, err = _run(str(tmp_path))
+    assert status == cli.EXIT_ERROR
+    assert 'b.py: error:' in err and 'RecursionError' in err
+    assert f'{tmp_path / "c.py"}:' in out
@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from qchecker.substructures import SUBSTRUCTURES
+
+from benchmarks import lsp
+from server.daemon import Daemon
+
+SOURCE = '''\
+def example(x):
+    if x:
+        return True
+    else:
+        return False
+'''
+CONFIG = { 'debounce': 0, 'substructures': { sub.name: True for sub in SUBSTRUCTURES } }
+
+
+class Client(lsp.Client):
+    '''an editor connected to the daemon over TCP'''
+
+    async def diagnostics(self):
+        '''answer configuration requests until diagnostics arrive'''
+        message = await self.until(lambda message: message.get('method') == 'textDocument/publishDiagnostics', CONFIG)
+        return message['params']
+
+    async def open(self, uri: str, text: str):
+        self.send({ 'id': 1, 'method': 'initialize', 'params': { 'processId': None, 'rootUri': None, 'capabilities': {} } })
+        self.send({ 'method': 'initialized', 'params': {} })
+        self.send({ 'method': 'textDocument/didOpen', 'params': { 'textDocument': {
+            'uri': uri, 'languageId': 'python', 'version': 1, 'text': text,
+        } } })
+        return await self.diagnostics()
+
+
+def test_clients_share_analyses():
+    async def main():
+        daemon = Daemon(warm_up=False, loop=asyncio.get_running_loop())
+        server = await daemon.serve_tcp('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        clients = [ Client(*await asyncio.open_connection('127.0.0.1', port)) for _ in range(4) ]
+
+        published = await asyncio.wait_for(asyncio.gather(*(
+            client.open(f'file:///student{n}/lab.py', SOURCE) for n, client in enumerate(clients)
+        )), 10)
+        assert [ params['uri'] for params in published ] == [ f'file:///student{n}/lab.py' for n in range(4) ]
+        assert len({ json.dumps(params['diagnostics']) for params in published }) == 1
+        assert published[0]['diagnostics']
+        clients[0].send({ 'id': 2, 'method': 'deodorant/stats', 'params': None })
+        stats = await asyncio.wait_for(clients[0].result(2), 10)
+        assert stats['daemon']['clients'] == 4
+        # one client analysed, the others waited for its result or found it cached
+        assert len(daemon.results) == 1 and daemon.results.hits == 3
+
+        clients[0].send({ 'method': 'exit', 'params': None })
+        clients[1].writer.close()
+        await asyncio.sleep(0.1)
+        assert daemon.stats()['clients'] == 2
+        assert not any( len(ls.documents) == 0 for ls in daemon.servers )
+
+        for client in clients[2:]:
+            client.writer.close()
+        server.close()
+        await server.wait_closed()
+        daemon.pool.shutdown()
+
+    asyncio.run(main())
+
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from qchecker.match import TextRange
+
+from server.diagnostics import PublishedDiagnostics
+from server.matches import MatchStore
+from server.payload import DiagnosticEncoder
+from server.server import PyDeodoriserServer
+
+URI = 'file:///example.py'
+ELIF = SimpleNamespace(name='Unnecessary Elif', technical_description='elif')
+NOT = SimpleNamespace(name='Redundant Not', technical_description='not')
+make = PyDeodoriserServer._make_diagnostic
+encoder = DiagnosticEncoder('Deodorant', 2)
+
+
+def test_unchanged_publish_is_skipped():
+    published = PublishedDiagnostics(make, encoder)
+    first = MatchStore.from_matches([ (TextRange(1, 0, 2, 4), ELIF) ])
+    assert published.changed(URI, first)
+
+    second = MatchStore.from_matches([ (TextRange(1, 0, 2, 4), ELIF) ])
+    assert published.same(URI, second)
+    assert not published.changed(URI, second)
+    assert published.stats() == {
+        'sent': 0, 'skipped': 1, 'unchanged': 0,
+        'bytes_saved': len(encoder.params(URI, first)),
+    }
+
+
+def test_changed_publish():
+    published = PublishedDiagnostics(make, encoder)
+    first = MatchStore.from_matches([ (TextRange(1, 0, 2, 4), ELIF) ])
+    published.changed(URI, first)
+
+    second = MatchStore.from_matches([ (TextRange(1, 0, 2, 4), ELIF), (TextRange(3, 0, 3, 9), NOT) ])
+    assert not published.same(URI, second)
+    assert published.changed(URI, second)
+    assert not published.changed(URI, MatchStore.from_matches([ (TextRange(1, 0, 2, 4), ELIF), (TextRange(3, 0, 3, 9), NOT) ]))
+
+    published.forget(URI)
+    assert published.changed(URI, second)
+
+
+def test_pull_answers_unchanged_for_the_current_result():
+    published = PublishedDiagnostics(make, encoder)
+    assert published.pull(URI) == { 'kind': 'full', 'items': [] }
+
+    matches = MatchStore.from_matches([ (TextRange(1, 0, 2, 4), ELIF) ])
+    published.changed(URI, matches)
+    report = published.pull(URI)
+    assert report['kind'] == 'full' and report['items'] == matches.diagnostics(make)
+
+    assert published.pull(URI, report['resultId']) == { 'kind': 'unchanged', 'resultId': report['resultId'] }
+    assert published.unchanged == 1
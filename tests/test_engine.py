@@ -0,0 +1,217 @@
+import ast
+import time
+from pathlib import Path
+from textwrap import dedent
+from types import SimpleNamespace
+
+import pytest
+
+from qchecker.substructures import SUBSTRUCTURES
+
+from server import engine
+from server.engine import Budget, NodeIndex, find_matches, parse
+from server.stats import Instrumentation
+
+TESTS = Path(__file__).parent
+EXAMPLE = TESTS.parent / 'example.py'
+
+
+def _qchecker_samples():
+    '''every dedented code snippet used in test_qchecker.py'''
+    tree = ast.parse((TESTS / 'test_qchecker.py').read_text())
+    return [ dedent(node.args[0].value)
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Call)
+        and getattr(node.func, 'id', None) == 'dedent'
+        and isinstance(node.args[0], ast.Constant)
+    ]
+
+
+SAMPLES = _qchecker_samples() + [ EXAMPLE.read_text() ]
+
+
+def _reference(code):
+    results = []
+    for sub in SUBSTRUCTURES:
+        try:
+            results.extend((match, sub) for match in sub.iter_matches(code))
+        except:
+            pass
+    return results
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_samples_are_analysed():
+    # the parity test below compares nothing if the samples do not parse
+    assert all(parse(code) is not None for code in SAMPLES)
+    assert any(_reference(code) for code in SAMPLES)
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_fused_rules_see_their_triggers():
+    for code in SAMPLES:
+        index = NodeIndex(parse(code))
+        for match, sub in _reference(code):
+            if sub.name in engine.TRIGGERS:
+                assert any(t in index for t in engine.TRIGGERS[sub.name]), sub.name
+
+
+@pytest.mark.filterwarnings('ignore')
+@pytest.mark.parametrize('fused', (False, True))
+@pytest.mark.parametrize('code', SAMPLES)
+def test_find_matches_identical(code, fused):
+    expected = _reference(code)
+    actual = find_matches(code, SUBSTRUCTURES, fused=fused)
+    assert [ (repr(match.text_range), sub.name) for match, sub in actual ] \
+        == [ (repr(match.text_range), sub.name) for match, sub in expected ]
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_find_matches_single_parse(monkeypatch):
+    calls = []
+    original = engine._ast_parse
+    def counting_parse(source, *args, **kwargs):
+        calls.append(source)
+        return original(source, *args, **kwargs)
+
+    monkeypatch.setattr('server.engine._ast_parse', counting_parse)
+    find_matches(EXAMPLE.read_text(), SUBSTRUCTURES)
+    assert len(calls) == 1
+
+
+def test_node_index_walk_order():
+    tree = ast.parse('x = a + -b\nif x:\n    y = not x + 1')
+    index = NodeIndex(tree)
+    walked = [ node for node in engine._ast_walk(tree)
+        if isinstance(node, (ast.BinOp, ast.UnaryOp))
+    ]
+    assert index.nodes((ast.BinOp, ast.UnaryOp)) == walked
+    assert ast.For not in index
+
+
+def test_find_matches_syntax_error():
+    assert parse('def foo(:') is None
+    assert find_matches('def foo(:', SUBSTRUCTURES) == []
+
+
+def test_parse_failure_is_remembered(monkeypatch):
+    calls = []
+    original = engine._ast_parse
+    def counting_parse(source, *args, **kwargs):
+        calls.append(source)
+        return original(source, *args, **kwargs)
+
+    monkeypatch.setattr('server.engine._ast_parse', counting_parse)
+    source = 'def remembered(:\n'
+    assert parse(source) is None and parse(source) is None
+    assert calls == [ source ]
+
+
+@pytest.mark.parametrize('source', (
+    'x = ' + '+'.join(['1'] * 5000) + '\n',  # RecursionError
+    'x = ' + '-' * 200000 + '1\n',  # MemoryError
+))
+def test_too_deep_to_parse(source, monkeypatch):
+    calls = []
+    original = engine._ast_parse
+    def counting_parse(source, *args, **kwargs):
+        calls.append(source)
+        return original(source, *args, **kwargs)
+
+    monkeypatch.setattr('server.engine._ast_parse', counting_parse)
+    assert parse(source) is None
+    assert find_matches(source, SUBSTRUCTURES) == []
+    assert len(calls) == 1
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_find_matches_instrumentation():
+    stats = Instrumentation()
+    code = EXAMPLE.read_text()
+    found = find_matches(code, SUBSTRUCTURES, stats=stats)
+    find_matches(code, SUBSTRUCTURES, stats=stats)
+
+    snapshot = stats.snapshot()
+    assert set(snapshot) == { sub.name for sub in SUBSTRUCTURES }
+    assert all(rule['calls'] == 2 for rule in snapshot.values())
+    assert sum(rule['matches'] for rule in snapshot.values()) == 2 * len(found)
+    assert 'Deodorant slowest rules' in stats.summary()
+
+
+def _spin(seconds: float):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+class _Slow:
+    name = 'Slow'
+
+    @staticmethod
+    def iter_matches(code):
+        for line in range(1, code.count('\n') + 1):
+            _spin(0.01)
+            yield SimpleNamespace(text_range=(line, 0))
+
+
+class _Waiting:
+    '''slow by the clock, but not busy, like a rule waiting for the GIL'''
+    name = 'Waiting'
+
+    @staticmethod
+    def iter_matches(code):
+        for line in range(1, code.count('\n') + 1):
+            time.sleep(0.01)
+            yield SimpleNamespace(text_range=(line, 0))
+
+
+class _SlowToFinish:
+    '''over its budget only after its last match'''
+    name = 'Slow To Finish'
+
+    @staticmethod
+    def iter_matches(code):
+        yield SimpleNamespace(text_range=(1, 0))
+        _spin(0.01)
+
+
+class _Fast:
+    name = 'Fast'
+
+    @staticmethod
+    def iter_matches(code):
+        yield SimpleNamespace(text_range=(1, 0))
+
+
+def test_rule_budget_abandons_slow_rule():
+    budget = Budget(rule=0.005)
+    found = find_matches('x = 1\ny = 2\n', [ _Slow, _Fast ], budget=budget)
+    assert [ sub for _, sub in found ] == [ _Fast ]
+    assert budget.overrun == [ 'Slow' ] and not budget.complete
+
+
+def test_rule_over_budget_loses_matches_found_in_time():
+    budget = Budget(rule=0.005)
+    found = find_matches('x = 1\ny = 2\n', [ _SlowToFinish, _Fast ], budget=budget)
+    assert [ sub for _, sub in found ] == [ _Fast ]
+    assert budget.overrun == [ 'Slow To Finish' ]
+
+
+def test_budget_counts_cpu_time():
+    budget = Budget(rule=0.005, document=0.005)
+    found = find_matches('x = 1\ny = 2\n', [ _Waiting, _Fast ], budget=budget)
+    assert [ sub for _, sub in found ] == [ _Waiting, _Waiting, _Fast ]
+    assert budget.complete
+
+
+def test_document_budget_skips_remaining_rules():
+    budget = Budget(document=0.005)
+    find_matches('x = 1\ny = 2\n', [ _Slow, _Fast ], budget=budget)
+    assert budget.skipped == [ 'Fast' ]
+
+
+def test_progress_reports_first_rules_early():
+    early = []
+    found = find_matches('x = 1\ny = 2\n', [ _Slow, _Fast ], first=('Fast',), progress=early.extend)
+    assert [ sub for _, sub in early ] == [ _Fast ]
+    assert [ sub for _, sub in found ] == [ _Slow, _Slow, _Fast ]
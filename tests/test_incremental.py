@@ -0,0 +1,182 @@
+import ast
+from collections import namedtuple
+from textwrap import dedent
+from types import SimpleNamespace
+
+from qchecker.match import TextRange
+
+from server.incremental import IncrementalAnalysis
+
+Match = namedtuple('Match', 'text_range')
+IF = SimpleNamespace(name='if')
+
+CODE = dedent('''
+import math
+
+def foo(x):
+    if x > 5:
+        return True
+    return False
+
+@decorated
+def bar(x):
+    y = x
+    if y:
+        pass
+
+x = 1
+if x:
+    print(x)
+
+class Baz:
+    def qux(self):
+        if self:
+            return 1
+''')
+
+
+def find_ifs(source, tree):
+    return [ (Match(TextRange(node.lineno, node.col_offset, node.end_lineno, node.end_col_offset)), IF)
+        for node in ast.walk(tree) if isinstance(node, ast.If)
+    ]
+
+
+def _edit(source, start_line, start_char, end_line, end_char, text):
+    lines = source.splitlines(keepends=True)
+    before = ''.join(lines[:start_line]) + lines[start_line][:start_char]
+    after = lines[end_line][end_char:] + ''.join(lines[end_line+1:])
+    return before + text + after
+
+
+def _check(source, changes):
+    incremental = IncrementalAnalysis(find_ifs)
+    incremental.full(source)
+    for change in changes:
+        source = _edit(source, *change)
+    incremental.update(source, [ (c[0], c[2], c[4]) for c in changes ])
+
+    full = IncrementalAnalysis(find_ifs)
+    full.full(source)
+    assert sorted(incremental.matches(), key=repr) == sorted(full.matches(), key=repr)
+    return incremental
+
+
+def test_edit_inside_function_only_reanalyses_it():
+    incremental = _check(CODE, [ (4, 11, 4, 12, '7') ])
+    assert incremental.analysed_lines == 5
+
+
+def test_inserted_lines_shift_following_blocks():
+    incremental = _check(CODE, [ (5, 0, 5, 0, '        pass\n    if x:\n        pass\n') ])
+    assert incremental.analysed_lines < len(CODE.splitlines())
+
+
+def test_deleted_block():
+    _check(CODE, [ (8, 0, 13, 0, '') ])
+
+
+def test_new_top_level_function():
+    _check(CODE, [ (6, 0, 6, 0, '\ndef new(x):\n    if x:\n        pass\n') ])
+
+
+def test_several_changes():
+    _check(CODE, [ (4, 11, 4, 12, '7'), (17, 0, 17, 0, 'if y:\n    pass\n'), (0, 0, 0, 0, '\n') ])
+
+
+def test_broken_edit_keeps_last_results():
+    incremental = IncrementalAnalysis(find_ifs)
+    incremental.full(CODE)
+    expected = incremental.matches()
+
+    broken = _edit(CODE, 3, 0, 3, 0, 'def (')
+    incremental.update(broken, [ (3, 3, 'def (') ])
+    assert incremental.broken
+    assert sorted(incremental.matches(), key=repr) == sorted(expected, key=repr)
+
+    incremental.update(CODE, [ (3, 3, '') ])
+    assert not incremental.broken
+    assert sorted(incremental.matches(), key=repr) == sorted(expected, key=repr)
+
+
+def test_broken_document_analyses_blocks_that_parse():
+    broken = _edit(CODE, 3, 0, 3, 0, 'def (')
+    incremental = IncrementalAnalysis(find_ifs)
+    incremental.full(broken)
+    assert incremental.broken
+    assert [ text_range.from_line for text_range, _ in incremental.matches() ] == [ 12, 16, 21 ]
+
+
+def test_snapshot_restore():
+    incremental = IncrementalAnalysis(find_ifs)
+    incremental.full(CODE)
+    snapshot = incremental.snapshot()
+    expected = incremental.matches()
+
+    incremental.update(_edit(CODE, 4, 11, 4, 12, '7'), [ (4, 4, '7') ])
+    incremental.restore(snapshot)
+    assert incremental.matches() == expected
+    assert incremental.analysed_lines == 0
+
+
+def test_focus_analyses_visible_segments_first():
+    full = IncrementalAnalysis(find_ifs)
+    full.full(CODE)
+
+    incremental = IncrementalAnalysis(find_ifs)
+    incremental.full(CODE, focus=(9, 13))
+    assert incremental.dirty
+    assert [ text_range.from_line for text_range, _ in incremental.matches() ] == [ 12 ]
+
+    calls = []
+    assert not incremental.refresh(CODE, stop=lambda: calls.append(1) or len(calls) > 1, chunk=1)
+    assert incremental.dirty
+    assert incremental.refresh(CODE, chunk=1)
+    assert not incremental.dirty
+    assert sorted(incremental.matches(), key=repr) == sorted(full.matches(), key=repr)
+
+
+def test_rules_skipped_by_the_budget_are_made_up_later():
+    compare = SimpleNamespace(name='compare')
+    rules = (IF, compare)
+    node_types = { 'if': ast.If, 'compare': ast.Compare }
+    def find(source, tree, subset=rules):
+        return [ (Match(TextRange(node.lineno, node.col_offset, node.end_lineno, node.end_col_offset)), sub)
+            for sub in subset for node in ast.walk(tree) if isinstance(node, node_types[sub.name])
+        ]
+
+    budget = SimpleNamespace(skipped=[])
+    calls = []
+    def analyse(source, tree, subset=rules):
+        calls.append(tuple( sub.name for sub in subset ))
+        if len(calls) == 1:
+            # the budget runs out before the second rule
+            budget.skipped.append('compare')
+            subset = subset[:1]
+        return find(source, tree, subset)
+
+    incremental = IncrementalAnalysis(analyse, rules)
+    incremental.budget = budget
+    incremental.full(CODE)
+    assert incremental.dirty
+    assert incremental.refresh(CODE)
+    assert not incremental.dirty
+    # the segments were kept, only the skipped rule ran on each
+    assert len(calls) > 2 and set(calls[1:]) == { ('compare',) }
+
+    full = IncrementalAnalysis(find, rules)
+    full.full(CODE)
+    assert incremental.matches() == full.matches()
+
+
+def test_edits_joining_statements_recovered_apart():
+    source = 'a = 1\ndef f(:\n'
+    incremental = IncrementalAnalysis(find_ifs)
+    incremental.full(source)
+    for change in [ (1, 0, 1, 0, 'a = 1\n'), (2, 0, 2, 7, 'a = 1') ]:
+        source = _edit(source, *change)
+        incremental.update(source, [ (change[0], change[2], change[4]) ])
+
+    full = IncrementalAnalysis(find_ifs)
+    full.full(source)
+    assert incremental.matches() == full.matches()
+    assert [ (seg.start, seg.end) for seg in incremental.segments ] == [ (seg.start, seg.end) for seg in full.segments ]
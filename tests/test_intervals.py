@@ -0,0 +1,36 @@
+import random
+
+from qchecker.match import TextRange
+
+from server.intervals import IntervalIndex
+
+
+def _contains(text_range, line, character):
+    return (text_range.from_line-1, text_range.from_offset) <= (line, character) \
+        <= (text_range.to_line-1, text_range.to_offset)
+
+
+def test_character_offsets():
+    index = IntervalIndex([ (TextRange(3, 4, 6, 27), 'elif'), (TextRange(4, 8, 4, 20), 'print') ])
+    assert index.first(2, 3) is None
+    assert index.first(2, 4) == (TextRange(3, 4, 6, 27), 'elif')
+    assert index.at(3, 10) == [ (TextRange(3, 4, 6, 27), 'elif'), (TextRange(4, 8, 4, 20), 'print') ]
+    assert index.first(5, 28) is None
+
+
+def test_matches_linear_scan():
+    rng = random.Random(399)
+    items = []
+    for n in range(500):
+        from_line = rng.randint(1, 200)
+        to_line = from_line + rng.randint(0, 5)
+        items.append((TextRange(from_line, rng.randint(0, 10), to_line, rng.randint(0, 30)), n))
+    index = IntervalIndex(items)
+    for line in range(0, 210):
+        for character in (0, 5, 15, 40):
+            expected = [ item for item in items if _contains(item[0], line, character) ]
+            assert index.at(line, character) == expected
+
+
+def test_empty():
+    assert IntervalIndex([]).first(0, 0) is None
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from qchecker.match import TextRange
+
+from server.intervals import IntervalIndex
+from server.matches import MatchStore
+
+ELIF = SimpleNamespace(name='Unnecessary Elif')
+NOT = SimpleNamespace(name='Redundant Not')
+
+
+def test_rows_and_pairs():
+    store = MatchStore.from_rows([ (3, 4, 6, 27, ELIF), (4, 8, 4, 20, NOT), (9, 0, 9, 5, ELIF) ])
+    assert len(store) == 3 and store.rules == [ ELIF, NOT ]
+    assert store[1] == (TextRange(4, 8, 4, 20), NOT)
+    assert list(store) == [ (TextRange(3, 4, 6, 27), ELIF), (TextRange(4, 8, 4, 20), NOT), (TextRange(9, 0, 9, 5), ELIF) ]
+    assert store.rows()[2] == (9, 0, 9, 5, ELIF)
+    assert store.nbytes() == 3 * 18
+
+
+def test_extend_shifts_lines_and_maps_rules():
+    store = MatchStore([ ELIF ])
+    store.append(1, 0, 2, 0, ELIF)
+    other = MatchStore.from_rows([ (1, 2, 1, 8, NOT), (2, 0, 3, 1, ELIF) ])
+    store.extend(other, 10)
+    store.extend(None)
+    assert store.rows() == [ (1, 0, 2, 0, ELIF), (11, 2, 11, 8, NOT), (12, 0, 13, 1, ELIF) ]
+
+
+def test_equality_ignores_rule_order():
+    first = MatchStore.from_rows([ (1, 0, 1, 4, ELIF), (2, 0, 2, 4, NOT) ])
+    second = MatchStore([ NOT, ELIF ])
+    second.extend(first)
+    assert first == second
+    second.append(3, 0, 3, 4, NOT)
+    assert first != second
+    assert MatchStore.from_rows([ (1, 0, 1, 4, NOT) ]) != MatchStore.from_rows([ (1, 0, 1, 4, ELIF) ])
+
+
+def test_interval_index_over_store():
+    store = MatchStore.from_rows([ (3, 4, 6, 27, ELIF), (4, 8, 4, 20, NOT) ])
+    index = IntervalIndex(store)
+    assert index.first(2, 3) is None
+    assert index.at(3, 10) == [ (TextRange(3, 4, 6, 27), ELIF), (TextRange(4, 8, 4, 20), NOT) ]
@@ -0,0 +1,32 @@
+import json
+from types import SimpleNamespace
+
+from pygls.lsp.types import PublishDiagnosticsParams
+
+from server.matches import MatchStore
+from server.payload import DiagnosticEncoder
+from server.server import PyDeodoriserServer
+
+URI = 'file:///café/example.py'
+ELIF = SimpleNamespace(name='Unnecessary Elif', technical_description='`elif` after "return"')
+NOT = SimpleNamespace(name='Redundant Not', technical_description='not')
+
+
+def test_same_json_as_pydantic():
+    matches = MatchStore.from_rows([ (3, 4, 6, 27, ELIF), (4, 8, 4, 20, NOT), (9, 0, 9, 5, ELIF) ])
+    encoder = DiagnosticEncoder(PyDeodoriserServer.DIAGNOSTIC_SOURCE, 2)
+    params = PublishDiagnosticsParams(uri=URI, diagnostics=matches.diagnostics(PyDeodoriserServer._make_diagnostic))
+    expected = json.loads(params.json(by_alias=True, exclude_unset=True))
+    assert json.loads(encoder.params(URI, matches)) == expected
+    assert json.loads(encoder.notification(URI, matches)) == {
+        'jsonrpc': '2.0', 'method': 'textDocument/publishDiagnostics', 'params': expected,
+    }
+    assert set(encoder.tails) == { ELIF.name, NOT.name }
+
+    params = PublishDiagnosticsParams(uri=URI, version=7, diagnostics=matches.diagnostics(PyDeodoriserServer._make_diagnostic))
+    assert json.loads(encoder.params(URI, matches, 7)) == json.loads(params.json(by_alias=True, exclude_unset=True))
+
+
+def test_no_matches():
+    encoder = DiagnosticEncoder('Deodorant', 2)
+    assert json.loads(encoder.params(URI, MatchStore())) == { 'uri': URI, 'diagnostics': [] }
@@ -0,0 +1,274 @@
+import asyncio
+
+from pygls.protocol import LanguageServerProtocol
+from qchecker.substructures import SUBSTRUCTURES
+
+from benchmarks import lsp
+from server.server import create_server
+
+URI = 'file:///lab.py'
+SOURCE = '''\
+def example(x):
+    if x:
+        return True
+    else:
+        return False
+'''
+CONFIG = { 'debounce': 0, 'substructures': { sub.name: True for sub in SUBSTRUCTURES } }
+
+
+class _Protocol(LanguageServerProtocol):
+    '''a connection whose end does not exit the process running the tests'''
+
+    def connection_lost(self, exc):
+        pass
+
+
+async def _connect(root_uri: str = None):
+    '''a server of its own on a free port, and an initialized client connected to it over TCP'''
+    loop = asyncio.get_running_loop()
+    ls = create_server(loop, _Protocol)
+    # pygls' Server makes a new event loop the current one
+    stray = asyncio.get_event_loop_policy().get_event_loop()
+    if stray is not loop:
+        stray.close()
+        asyncio.set_event_loop(loop)
+    ls.warm_up_enabled = False
+    listener = await loop.create_server(lambda: ls.lsp, '127.0.0.1', 0)
+    client = lsp.Client(*await asyncio.open_connection('127.0.0.1', listener.sockets[0].getsockname()[1]))
+    client.send({ 'id': 1, 'method': 'initialize', 'params': { 'processId': None, 'rootUri': root_uri, 'capabilities': {} } })
+    await asyncio.wait_for(client.result(1), 10)
+    return ls, listener, client
+
+
+async def _disconnect(ls, listener, client):
+    client.writer.close()
+    listener.close()
+    await listener.wait_closed()
+    if ls.pool is not None:
+        ls.pool.shutdown()
+
+
+def _open(client, uri: str = URI, text: str = SOURCE):
+    client.send({ 'method': 'textDocument/didOpen', 'params': { 'textDocument': {
+        'uri': uri, 'languageId': 'python', 'version': 1, 'text': text,
+    } } })
+
+
+def _change(client, version: int, text: str, uri: str = URI):
+    client.send({ 'method': 'textDocument/didChange', 'params': {
+        'textDocument': { 'uri': uri, 'version': version }, 'contentChanges': [ { 'text': text } ],
+    } })
+
+
+def _close(client, uri: str = URI):
+    client.send({ 'method': 'textDocument/didClose', 'params': { 'textDocument': { 'uri': uri } } })
+
+
+async def _analysed(ls, version: int, uri: str = URI):
+    '''wait until the server holds the results of `version` of the document'''
+    while getattr(ls.documents.get(uri), 'version', None) != version:
+        await asyncio.sleep(0.01)
+
+
+def test_close_right_behind_open():
+    async def main():
+        ls, listener, client = await _connect()
+        _open(client)
+        _close(client)
+        client.send({ 'id': 2, 'method': 'shutdown', 'params': None })
+        await asyncio.wait_for(client.result(2, CONFIG), 10)
+        # handled in order, the close cancels the run the open scheduled
+        assert URI not in ls.scheduler.tasks and URI not in ls.documents
+
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_closing_before_the_configuration_arrives():
+    async def main():
+        ls, listener, client = await _connect()
+        _open(client)
+        message = await asyncio.wait_for(client.until(
+            lambda message: message.get('method') == 'workspace/configuration'
+        ), 10)
+        _close(client)
+        await asyncio.sleep(0.1)
+        client.send({ 'id': message['id'], 'result': [ CONFIG ] })
+        client.send({ 'id': 2, 'method': 'shutdown', 'params': None })
+        # the connection outlives the answer to a request nothing waits for any more
+        await asyncio.wait_for(client.result(2), 10)
+
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_disk_cache_written_on_open_and_close(tmp_path):
+    config = { **CONFIG, 'cacheDirectory': str(tmp_path) }
+
+    async def main():
+        ls, listener, client = await _connect()
+        _open(client)
+        await asyncio.wait_for(client.until(
+            lambda message: message.get('method') == 'textDocument/publishDiagnostics', config
+        ), 10)
+        for version in (2, 3):
+            _change(client, version, SOURCE + f'x = {version}\n')
+            await asyncio.wait_for(_analysed(ls, version), 10)
+        _close(client)
+        client.send({ 'id': 2, 'method': 'shutdown', 'params': None })
+        await asyncio.wait_for(client.result(2), 10)
+        ls.disk_writer.shutdown()
+
+        # the opened version and the one closed, not the one typed in between
+        assert ls.disk_cache.writes == 2
+        assert len(list(tmp_path.rglob('*.bin'))) == 2
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_scan_workspace(tmp_path):
+    (tmp_path / 'a.py').write_text(SOURCE)
+    (tmp_path / 'clean.py').write_text('print(1)\n')
+    (tmp_path / 'broken.py').symlink_to(tmp_path / 'missing.py')
+    received = []
+    def collect(message):
+        received.append(message)
+        return message.get('id') == 2
+
+    async def main():
+        ls, listener, client = await _connect(tmp_path.as_uri())
+        client.send({ 'id': 2, 'method': 'workspace/executeCommand', 'params': {
+            'command': 'deodorant.scanWorkspace', 'arguments': [],
+        } })
+        assert (await asyncio.wait_for(client.until(collect, CONFIG), 60))['result'] == 3
+
+        published = [ m['params'] for m in received if m.get('method') == 'textDocument/publishDiagnostics' ]
+        logged = ' '.join( m['params']['message'] for m in received if m.get('method') == 'window/logMessage' )
+        assert [ params['uri'] for params in published ] == [ (tmp_path / 'a.py').as_uri() ]
+        assert published[0]['diagnostics']
+        assert 'could not scan' in logged and '1 could not be analysed' in logged
+        # files that are not open are not remembered
+        assert not ls.published.published
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_stats_request():
+    async def main():
+        ls, listener, client = await _connect()
+        client.send({ 'id': 2, 'method': 'deodorant/stats', 'params': None })
+        stats = await asyncio.wait_for(client.result(2, CONFIG), 10)
+        assert { 'rules', 'scheduler', 'cache', 'publish', 'documents' } <= set(stats)
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_pull_diagnostics_request():
+    config = { **CONFIG, 'pullDiagnostics': True }
+
+    async def main():
+        ls, listener, client = await _connect()
+        _open(client)
+        client.send({ 'id': 2, 'method': 'textDocument/diagnostic', 'params': { 'textDocument': { 'uri': URI } } })
+        report = await asyncio.wait_for(client.result(2, config), 10)
+        assert report['kind'] == 'full' and report['items'] and report['resultId']
+
+        client.send({ 'id': 3, 'method': 'textDocument/diagnostic', 'params': {
+            'textDocument': { 'uri': URI }, 'previousResultId': report['resultId'],
+        } })
+        assert await asyncio.wait_for(client.result(3, config), 10) == { 'kind': 'unchanged', 'resultId': report['resultId'] }
+        # a result id for each set of diagnostics, but no notification sent
+        client.send({ 'id': 4, 'method': 'deodorant/stats', 'params': None })
+        assert (await asyncio.wait_for(client.result(4), 10))['publish']['sent'] == 0
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_pull_diagnostics_setting_is_read_once():
+    async def main():
+        ls, listener, client = await _connect()
+        ls.apply_config(CONFIG)
+        client.send({ 'method': 'workspace/didChangeConfiguration', 'params': { 'settings': {
+            'Deodorant': { **CONFIG, 'pullDiagnostics': True },
+        } } })
+        client.send({ 'id': 2, 'method': 'shutdown', 'params': None })
+        await asyncio.wait_for(client.result(2), 10)
+        # the client would not start pulling until reloaded, so the server keeps pushing
+        assert not ls.pull_diagnostics
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_no_early_diagnostics_from_recovered_blocks():
+    config = { **CONFIG, 'progressiveLines': 1 }
+    text = SOURCE + 'def broken(:\n    pass\n' + SOURCE.replace('example', 'other') + 'x = x + 1\n'
+
+    async def main():
+        ls, listener, client = await _connect()
+        _open(client, text=text)
+        client.send({ 'id': 2, 'method': 'textDocument/diagnostic', 'params': { 'textDocument': { 'uri': URI } } })
+        received = []
+        def collect(message):
+            received.append(message)
+            return message.get('id') == 2
+        await asyncio.wait_for(client.until(collect, config), 10)
+
+        published = [ m['params']['diagnostics'] for m in received if m.get('method') == 'textDocument/publishDiagnostics' ]
+        key = lambda d: (d['range']['start']['line'], d['range']['start']['character'], d['message'])
+        final = { key(d) for d in published[-1] }
+        assert any( line == text.count('\n') - 1 for line, _, _ in final )
+        # every diagnostic shown on the way is one of the document's, at its line
+        assert all( key(d) in final for diagnostics in published for d in diagnostics )
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_one_configuration_request_at_startup():
+    async def main():
+        ls, listener, client = await _connect()
+        client.send({ 'method': 'initialized', 'params': {} })
+        _open(client)
+        requests = []
+        def answer(message):
+            if message.get('method') == 'workspace/configuration':
+                requests.append(message)
+                client.send({ 'id': message['id'], 'result': [ CONFIG ] })
+            return message.get('method') == 'textDocument/publishDiagnostics'
+        await asyncio.wait_for(client.until(answer), 10)
+        assert len(requests) == 1
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
+
+
+def test_hover_on_an_evicted_document_analyses_it_again():
+    other = 'file:///other.py'
+
+    async def main():
+        ls, listener, client = await _connect()
+        ls.apply_config(CONFIG)
+        ls.documents.max_documents = 1
+        _open(client)
+        await asyncio.wait_for(_analysed(ls, 1), 10)
+        _open(client, other)
+        await asyncio.wait_for(_analysed(ls, 1, other), 10)
+        assert URI not in ls.documents
+
+        hover = { 'textDocument': { 'uri': URI }, 'position': { 'line': 1, 'character': 6 } }
+        client.send({ 'id': 2, 'method': 'textDocument/hover', 'params': hover })
+        assert await asyncio.wait_for(client.result(2), 10) is None
+        await asyncio.wait_for(_analysed(ls, 1), 10)
+        client.send({ 'id': 3, 'method': 'textDocument/hover', 'params': hover })
+        assert (await asyncio.wait_for(client.result(3), 10))['contents']
+        await _disconnect(ls, listener, client)
+
+    asyncio.run(main())
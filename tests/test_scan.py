@@ -0,0 +1,78 @@
+import multiprocessing
+from textwrap import dedent
+
+from qchecker.substructures import SUBSTRUCTURES
+
+from server import scan as scan_module
+from server.engine import find_matches
+from server.scan import iter_python_files, scan
+
+CODE = dedent('''
+def foo(x):
+    if x > 5:
+        return True
+    else:
+        return False
+x = x + 1
+''')
+
+DEEP = 'x = ' + '+'.join([ '1' ] * 5000) + '\n'  # too deep for the parser
+
+
+def _tree(tmp_path):
+    (tmp_path / 'pkg').mkdir()
+    (tmp_path / '.venv').mkdir()
+    (tmp_path / 'a.py').write_text(CODE)
+    (tmp_path / 'pkg' / 'b.py').write_text(CODE)
+    (tmp_path / 'pkg' / 'notes.txt').write_text(CODE)
+    (tmp_path / '.venv' / 'c.py').write_text(CODE)
+    return tmp_path
+
+
+def test_iter_python_files(tmp_path):
+    root = _tree(tmp_path)
+    assert list(iter_python_files([ str(root) ])) == [
+        str(root / 'a.py'), str(root / 'pkg' / 'b.py'),
+    ]
+
+
+def test_scan_matches_engine(tmp_path):
+    root = _tree(tmp_path)
+    expected = [ (m.text_range.from_line, m.text_range.from_offset, m.text_range.to_line, m.text_range.to_offset, sub.name)
+        for m, sub in find_matches(CODE, SUBSTRUCTURES)
+    ]
+    for workers in (1, 2):
+        results = sorted(scan([ str(root) ], workers=workers, chunk_size=1), key=lambda r: r.path)
+        assert [ r.path for r in results ] == [ str(root / 'a.py'), str(root / 'pkg' / 'b.py') ]
+        assert all(r.matches == expected and r.error is None for r in results)
+
+
+def test_scan_reports_unreadable_files(tmp_path):
+    result, = scan([ str(tmp_path / 'missing.py') ], workers=1)
+    assert result.error and result.matches == []
+
+
+def test_scan_with_spawned_workers(tmp_path):
+    root = _tree(tmp_path)
+    results = list(scan([ str(root) ], workers=2, chunk_size=1, context=multiprocessing.get_context('spawn')))
+    assert sorted( r.path for r in results ) == [ str(root / 'a.py'), str(root / 'pkg' / 'b.py') ]
+    assert all(r.matches and r.error is None for r in results)
+
+
+def test_scan_isolates_failing_files(tmp_path, monkeypatch):
+    for name, code in (('a.py', CODE), ('b.py', DEEP), ('c.py', CODE)):
+        (tmp_path / name).write_text(code)
+    results = list(scan([ str(tmp_path) ], workers=1))
+    assert [ (r.path[-4:], bool(r.matches), r.error) for r in results ] == [
+        ('a.py', True, None), ('b.py', False, None), ('c.py', True, None),
+    ]
+
+    analyse = scan_module.analyse_source
+    def analyse_or_fail(source, substructures):
+        if source == DEEP: raise RecursionError('maximum recursion depth exceeded')
+        return analyse(source, substructures)
+
+    monkeypatch.setattr(scan_module, 'analyse_source', analyse_or_fail)
+    results = list(scan([ str(tmp_path) ], workers=1))
+    assert [ bool(r.matches) for r in results ] == [ True, False, True ]
+    assert 'RecursionError' in results[1].error
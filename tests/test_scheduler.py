@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+from server.scheduler import ValidationScheduler
+
+
+def _document(version):
+    return SimpleNamespace(uri='file:///a.py', version=version)
+
+
+def test_pending_runs_are_coalesced():
+    runs = []
+    async def validate(document, changes, version):
+        runs.append((version, changes))
+
+    async def main():
+        scheduler = ValidationScheduler(validate, debounce=0.01)
+        for version in range(1, 6):
+            scheduler.schedule(_document(version), [ version ])
+        await asyncio.sleep(0.05)
+        return scheduler
+
+    scheduler = asyncio.run(main())
+    assert runs == [ (5, [1, 2, 3, 4, 5]) ]
+    assert scheduler.coalesced == 4
+    assert scheduler.completed == 1
+
+
+def test_running_run_is_cancelled_and_hands_over_changes():
+    runs = []
+    async def validate(document, changes, version):
+        await asyncio.sleep(0.02)
+        runs.append((version, changes))
+
+    async def main():
+        scheduler = ValidationScheduler(validate, debounce=0)
+        scheduler.schedule(_document(1), [ 'a' ])
+        await asyncio.sleep(0.01)
+        scheduler.schedule(_document(2), [ 'b' ])
+        await asyncio.sleep(0.05)
+        return scheduler
+
+    scheduler = asyncio.run(main())
+    assert runs == [ (2, ['a', 'b']) ]
+    assert scheduler.cancelled == 1
+
+
+def test_full_analysis_is_sticky():
+    runs = []
+    async def validate(document, changes, version):
+        runs.append(changes)
+
+    async def main():
+        scheduler = ValidationScheduler(validate, debounce=0.01)
+        scheduler.schedule(_document(1))
+        scheduler.schedule(_document(2), [ 'b' ])
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert runs == [ None ]
+
+
+def test_committed_run_finishes_before_the_next_starts():
+    events = []
+    async def main():
+        async def validate(document, changes, version):
+            scheduler.commit()
+            events.append(('start', version, changes))
+            await asyncio.sleep(0.02)
+            events.append(('end', version))
+
+        scheduler = ValidationScheduler(validate, debounce=0)
+        scheduler.schedule(_document(1), [ 'a' ])
+        await asyncio.sleep(0.01)
+        scheduler.schedule(_document(2), [ 'b' ])
+        await asyncio.sleep(0.06)
+        return scheduler
+
+    scheduler = asyncio.run(main())
+    assert events == [ ('start', 1, ['a']), ('end', 1), ('start', 2, ['b']), ('end', 2) ]
+    assert scheduler.cancelled == 1
+    assert scheduler.completed == 2
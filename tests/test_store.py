@@ -0,0 +1,31 @@
+from server.store import MATCH_BYTES, DocumentStore
+
+
+def test_least_recently_used_document_is_evicted():
+    store = DocumentStore(max_documents=2)
+    store.open('a')
+    store.open('b')
+    store.get('a')
+    store.open('c')
+    assert list(store) == [ 'a', 'c' ]
+    assert store.evictions == 1
+
+
+def test_memory_budget():
+    store = DocumentStore(max_bytes=10 * MATCH_BYTES)
+    for uri in 'abc':
+        state = store.open(uri)
+        state.matches = [ None ] * 4
+        store.update(state)
+    assert list(store) == [ 'b', 'c' ]
+    assert store.size == 8 * MATCH_BYTES
+
+
+def test_close_frees_memory():
+    store = DocumentStore()
+    state = store.open('a')
+    state.matches = [ None ] * 3
+    store.update(state)
+    assert store.close('a') is state
+    assert store.close('a') is None
+    assert store.size == 0 and len(store) == 0